@@ -0,0 +1,220 @@
+# admission.py
+"""
+Priority-aware admission control for the HTTP API and the database pollers.
+
+Every request is mapped to a priority class by path. Each class has its own
+concurrency limit, queue length and queue timeout, so a burst in one class
+cannot take every slot from the others. An admitted request then waits for
+its database connection (the request's queries reuse it), again bounded by
+the class timeout.
+
+The pool is shared with MQTT ingest and the background tasks, which are not
+admitted here, so the class limits alone cannot keep connections for alarm
+reads. Shedding therefore also looks at the pool: normal and low work is
+refused while fewer than ADMISSION_NORMAL_POOL_RESERVE / ADMISSION_LOW_POOL_RESERVE
+connections are free, which keeps those connections for critical requests.
+Low-priority work (exports, bulk catalog reads) is shed with 503 + Retry-After:
+  - when its own queue is full or it waited longer than its queue timeout,
+    for a slot or for a connection;
+  - when free connections fall below its reserve;
+  - as soon as critical requests are queueing, so alarm reads never wait
+    behind an export.
+
+Other DB pollers go through `admitted(name)` as well; the /ws/zones poll is
+"normal" work (main.py).
+
+Per-class metrics (in flight, queued, admitted, shed, pool wait and latency
+percentiles including queue time) and the pool state are exposed at
+/metrics/admission.
+
+Implemented as a plain ASGI middleware so it adds no per-request task or
+body buffering; WebSocket connections themselves are not limited here.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+from config import settings
+from db import database, pool_free, pool_metrics
+
+# Path prefix -> class, first match wins. Anything else is "normal".
+ROUTE_CLASSES = [
+    ("/ready", None),                 # probes and metrics are never queued or shed
+    ("/metrics", None),
+    ("/logging", None),
+    ("/alarms", "critical"),
+    ("/Alerts", "critical"),
+    ("/zones/status", "critical"),
+    ("/Observations", "low"),
+    ("/Sensors", "low"),
+    ("/ObservedProperties", "low"),
+    ("/employees/", "low"),           # trajectories (/employees/positions is in ROUTE_OVERRIDES)
+]
+ROUTE_OVERRIDES = {"/employees/positions": "normal"}
+
+
+def _percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64)
+    if not values.size:
+        return {"p50": None, "p95": None, "p99": None}
+    return dict(zip(("p50", "p95", "p99"), (round(float(v), 2) for v in np.percentile(values, [50, 95, 99]))))
+
+
+class PriorityClass:
+    def __init__(self, name, limit, max_queue, queue_timeout, pool_reserve):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.pool_reserve = pool_reserve  # shed while fewer connections than this are free
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0, "pool": 0, "critical_waiting": 0}
+        self.pool_waits_ms = deque(maxlen=2048)
+        self.latencies_ms = deque(maxlen=2048)
+
+    def metrics(self):
+        return {
+            "limit": self.limit,
+            "pool_reserve": self.pool_reserve,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "pool_wait_ms": _percentiles(self.pool_waits_ms),
+            "latency_ms": _percentiles(self.latencies_ms),
+        }
+
+
+CLASSES = {
+    "critical": PriorityClass("critical", settings.ADMISSION_CRITICAL_LIMIT, 200, settings.ADMISSION_CRITICAL_TIMEOUT, 0),
+    "normal": PriorityClass("normal", settings.ADMISSION_NORMAL_LIMIT, 100, settings.ADMISSION_NORMAL_TIMEOUT,
+                            settings.ADMISSION_NORMAL_POOL_RESERVE),
+    "low": PriorityClass("low", settings.ADMISSION_LOW_LIMIT, 20, settings.ADMISSION_LOW_TIMEOUT,
+                         settings.ADMISSION_LOW_POOL_RESERVE),
+}
+
+
+class Shed(Exception):
+    """The work was refused; `reason` is one of PriorityClass.shed's keys."""
+
+    def __init__(self, priority, reason):
+        super().__init__(f"{priority.name} work shed ({reason})")
+        self.priority = priority
+        self.reason = reason
+
+
+def classify(path):
+    if path in ROUTE_OVERRIDES:
+        return ROUTE_OVERRIDES[path]
+    for prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return "normal"
+
+
+def admission_metrics():
+    return {"pool": pool_metrics(), **{name: priority.metrics() for name, priority in CLASSES.items()}}
+
+
+def _shed_reason(priority):
+    if priority.name == "low" and CLASSES["critical"].queued > 0:
+        return "critical_waiting"
+    if priority.pool_reserve:
+        free = pool_free()
+        if free is not None and free < priority.pool_reserve:
+            return "pool"
+    return None
+
+
+def _shed(priority, reason):
+    priority.shed[reason] += 1
+    return Shed(priority, reason)
+
+
+@asynccontextmanager
+async def admitted(name):
+    """
+    Run the body as work of class `name`: holding one of its slots and the
+    task's database connection. Raises Shed (before the body runs) when the
+    work has to be dropped.
+    """
+    priority = CLASSES[name]
+    arrived = time.perf_counter()
+    if priority.queued >= priority.max_queue:
+        raise _shed(priority, "queue_full")
+    reason = _shed_reason(priority)
+    if reason:
+        raise _shed(priority, reason)
+
+    priority.queued += 1
+    try:
+        await asyncio.wait_for(priority.semaphore.acquire(), timeout=priority.queue_timeout)
+    except asyncio.TimeoutError:
+        raise _shed(priority, "timeout")
+    finally:
+        priority.queued -= 1
+
+    try:
+        # The pool may have drained while this request was queued.
+        reason = _shed_reason(priority)
+        if reason:
+            raise _shed(priority, reason)
+        connection = database.connection()
+        waiting = time.perf_counter()
+        try:
+            await asyncio.wait_for(connection.__aenter__(), timeout=priority.queue_timeout)
+        except asyncio.TimeoutError:
+            raise _shed(priority, "timeout")
+        priority.pool_waits_ms.append((time.perf_counter() - waiting) * 1000)
+
+        priority.in_flight += 1
+        priority.admitted += 1
+        try:
+            yield
+        finally:
+            priority.in_flight -= 1
+            await connection.__aexit__(None, None, None)
+            priority.latencies_ms.append((time.perf_counter() - arrived) * 1000)
+    finally:
+        priority.semaphore.release()
+
+
+async def _reject(send, priority):
+    body = json.dumps({"detail": f"Server busy ({priority.name} requests are being shed), retry later"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"retry-after", str(settings.ADMISSION_RETRY_AFTER_SECONDS).encode()),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = classify(scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            async with admitted(name):
+                await self.app(scope, receive, send)
+        except Shed as e:
+            await _reject(send, e.priority)
@@ -1,20 +1,20 @@
 # alerts_router.py
 from fastapi import APIRouter
 from db import database
-import json
+from zone_state import ACTIVE_ALERTS_QUERY, properties_of, alert_of
 
 alerts_router = APIRouter(prefix="/Alerts", tags=["Alerts"])
 
 @alerts_router.get("/")
 async def get_active_alerts():
-    # For example, we check zones for an 'alert' key in properties.
-    query = "SELECT name, risk_level, properties FROM zone WHERE properties->>'alert' IS NOT NULL"
-    rows = await database.fetch_all(query=query)
+    # Served by the partial index over active alerts in zone_state (see zone_state.py)
+    rows = await database.fetch_all(query=ACTIVE_ALERTS_QUERY)
     alerts = []
     for row in rows:
         alerts.append({
             "zone": row["name"],
             "risk_level": row["risk_level"],
-            "alert_details": json.loads(row["properties"]) if row["properties"] else {}
+            "alert": alert_of(row),
+            "alert_details": properties_of(row)
         })
     return alerts
@@ -0,0 +1,240 @@
+# anomaly_detector.py
+"""
+Streaming anomaly detection over sensor series.
+
+The fixed thresholds in mqtt_client.apply_reading miss a temperature that
+climbs fast while still under 70 °C, and flap on noisy readings around the
+limit. This stage keeps, per datastream, an EWMA of the value and of its
+variance plus the last reading, all stored in numpy arrays indexed by a slot
+number:
+
+  - z-score:        |x - ewma| / sqrt(ewma_var) against Z_ENTER / Z_EXIT
+  - trend:          time-weighted EWMA of the rise per minute against
+                    RATE_LIMITS[sensor_type], so single noisy jumps are not a rise.
+                    On a noisy series the limit is raised to Z_ENTER / Z_EXIT
+                    times the trend that the series' own reading-to-reading
+                    noise produces by chance, so a stationary series never
+                    counts as rising however noisy it is
+
+Ingest only appends (slot, value, time) to a pending list (O(1), no query).
+`tick()` runs on a timer and updates every datastream at once with vectorized
+numpy operations. Hysteresis (enter above Z_ENTER, leave below Z_EXIT) keeps
+the state from flapping. Zones whose anomaly state differs from what was last
+written are written to the anomaly alert slot of zone_state, which is the zone
+alert while no fixed threshold is exceeded. A zone only counts as written once
+the UPDATE succeeded, so a failed write is retried on the next tick.
+"""
+import logging
+import time
+
+import numpy as np
+
+from config import settings
+from zone_state import set_anomaly_alert, clear_anomaly_alert
+
+logger = logging.getLogger(__name__)
+
+# Maximum rise per minute before a reading is considered abnormal, per sensor type.
+RATE_LIMITS = {
+    "Heat": 5.0,       # °C / min
+    "Pression": 1.0,   # bar / min
+    "Smoke": 2.0,      # ppm / min
+}
+# Spark is a boolean alarm on its own; a z-score on 0/1 carries no information.
+DETECTED_TYPES = set(RATE_LIMITS)
+
+WARMUP_SAMPLES = 30          # readings before the z-score and trend are trusted
+TREND_TIME_CONSTANT = 60.0   # seconds of history the rise-per-minute trend averages over
+VARIANCE_FLOOR = 1e-6
+
+
+class AnomalyDetector:
+    def __init__(self, capacity=64):
+        self.slots = {}           # datastream_id -> slot
+        self.zone_names = []      # slot -> zone name
+        self.sensor_types = []    # slot -> sensor type
+        self._allocate(capacity)
+        self.pending_slots = []
+        self.pending_values = []
+        self.pending_times = []
+        self.zone_alerts = {}     # zone name -> (alert code, sensor type) of the active anomaly
+        self.written_alerts = {}  # the same, as last written to zone_state
+
+    def _allocate(self, capacity):
+        def grow(name, fill, dtype):
+            new = np.full(capacity, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                new[:old.size] = old
+            setattr(self, name, new)
+
+        grow("mean", 0.0, np.float64)
+        grow("var", 0.0, np.float64)
+        grow("rate_var", 0.0, np.float64)
+        grow("last_value", np.nan, np.float64)
+        grow("last_time", np.nan, np.float64)
+        grow("count", 0, np.int64)
+        grow("rate_limit", np.inf, np.float64)
+        grow("active", False, np.bool_)
+        grow("rate_flag", False, np.bool_)
+        grow("z_score", 0.0, np.float64)
+        grow("trend", 0.0, np.float64)
+        self.capacity = capacity
+
+    def observe(self, datastream_id, value, zone_name, sensor_type, timestamp=None):
+        """Queue one reading; called from the ingest path for every message."""
+        if sensor_type not in DETECTED_TYPES:
+            return
+        slot = self.slots.get(datastream_id)
+        if slot is None:
+            slot = len(self.zone_names)
+            if slot >= self.capacity:
+                self._allocate(self.capacity * 2)
+            self.slots[datastream_id] = slot
+            self.zone_names.append(zone_name)
+            self.sensor_types.append(sensor_type)
+            self.rate_limit[slot] = RATE_LIMITS[sensor_type]
+        self.pending_slots.append(slot)
+        self.pending_values.append(float(value))
+        self.pending_times.append(timestamp or time.time())
+
+    def tick(self):
+        """
+        Fold all pending readings into the per-datastream state. Returns
+        {zone name: (alert code, sensor type) or None} for zones whose state differs
+        from zone_state; report each successful write back with mark_written().
+        """
+        if self.pending_slots:
+            self._fold()
+        return self.unwritten()
+
+    def unwritten(self):
+        return {
+            zone: self.zone_alerts.get(zone)
+            for zone in set(self.written_alerts) | set(self.zone_alerts)
+            if self.written_alerts.get(zone) != self.zone_alerts.get(zone)
+        }
+
+    def mark_written(self, zone_name, anomaly):
+        if anomaly:
+            self.written_alerts[zone_name] = anomaly
+        else:
+            self.written_alerts.pop(zone_name, None)
+
+    def _fold(self):
+        slots = np.asarray(self.pending_slots, dtype=np.int64)
+        values = np.asarray(self.pending_values, dtype=np.float64)
+        times = np.asarray(self.pending_times, dtype=np.float64)
+        self.pending_slots, self.pending_values, self.pending_times = [], [], []
+
+        # A datastream can have several readings in one tick. Process them in
+        # rounds (1st reading of every datastream, then 2nd, ...) so each round
+        # is a single vectorized update with unique slots, in arrival order.
+        order = np.argsort(slots, kind="stable")
+        sorted_slots = slots[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(sorted_slots)) + 1]
+        rank = np.arange(sorted_slots.size) - np.repeat(starts, np.diff(np.r_[starts, sorted_slots.size]))
+        for r in range(int(rank.max()) + 1):
+            picked = order[rank == r]
+            self._update(slots[picked], values[picked], times[picked])
+        self._refresh_zone_alerts()
+
+    def _update(self, slots, x, t):
+        alpha = settings.ANOMALY_EWMA_ALPHA
+        mean, var, count = self.mean[slots], self.var[slots], self.count[slots]
+
+        # Score against the state *before* this reading.
+        z = np.abs(x - mean) / np.sqrt(np.maximum(var, VARIANCE_FLOOR))
+        z = np.where(count >= WARMUP_SAMPLES, z, 0.0)
+        dt = np.maximum(t - self.last_time[slots], 1e-3)
+        has_last = ~np.isnan(self.last_value[slots])
+        rate = np.where(has_last, (x - self.last_value[slots]) / dt * 60.0, 0.0)
+        previous_trend = self.trend[slots]
+        # Time-weighted smoothing: closely spaced readings get a proportionally
+        # small weight, so noise over a tiny dt cannot fake a steep rise.
+        weight = 1.0 - np.exp(-dt / TREND_TIME_CONSTANT)
+        trend = np.where(has_last, previous_trend + weight * (rate - previous_trend), 0.0)
+
+        # Spread of the trend that noise alone produces: on a stationary series
+        # the rates are differences of independent readings, and their EWMA has
+        # w / sqrt(2 - w) times their standard deviation. rate_var is measured
+        # around the trend, so a steady rise does not inflate it.
+        rate_var = self.rate_var[slots]
+        trend_noise = weight / np.sqrt(2.0 - weight) * np.sqrt(rate_var)
+        warmed = count >= WARMUP_SAMPLES
+        limit = self.rate_limit[slots]
+        rise_enter = warmed & (trend > np.maximum(limit, settings.ANOMALY_Z_ENTER * trend_noise))
+        rise_stay = warmed & (trend > np.maximum(limit * 0.5, settings.ANOMALY_Z_EXIT * trend_noise))
+        enter = (z > settings.ANOMALY_Z_ENTER) | rise_enter
+        stay = (z > settings.ANOMALY_Z_EXIT) | rise_stay
+        self.active[slots] = np.where(self.active[slots], stay, enter)
+        self.rate_flag[slots] = rise_stay
+        self.z_score[slots] = z
+        self.trend[slots] = trend
+
+        # EWMA mean/variance (West's incremental form). The first readings are
+        # plain running averages (weight 1/n), so the variance starts from a
+        # real estimate instead of 0. Variances use the slower
+        # ANOMALY_VARIANCE_ALPHA: a short-memory estimate dips often enough on
+        # pure noise for ordinary readings to score above Z_ENTER.
+        n = count + 1
+        mean_alpha = np.maximum(alpha, 1.0 / n)
+        var_alpha = np.maximum(settings.ANOMALY_VARIANCE_ALPHA, 1.0 / n)
+        diff = x - mean
+        self.mean[slots] = mean + mean_alpha * diff
+        self.var[slots] = (1 - var_alpha) * (var + var_alpha * diff * diff)
+        rate_diff = rate - previous_trend
+        rate_alpha = np.maximum(settings.ANOMALY_VARIANCE_ALPHA, 1.0 / np.maximum(count, 1))
+        self.rate_var[slots] = np.where(has_last, (1 - rate_alpha) * (rate_var + rate_alpha * rate_diff * rate_diff), 0.0)
+        self.count[slots] = count + 1
+        self.last_value[slots] = x
+        self.last_time[slots] = t
+
+    def _refresh_zone_alerts(self):
+        alerts = {}
+        for slot in np.flatnonzero(self.active[:len(self.zone_names)]):
+            zone, sensor_type = self.zone_names[slot], self.sensor_types[slot]
+            if zone in alerts:
+                continue
+            code = "ANOMALY_RAPID_RISE" if self.rate_flag[slot] else "ANOMALY_READING"
+            alerts[zone] = (code, sensor_type)
+        self.zone_alerts = alerts
+
+    def active_anomalies(self):
+        result = []
+        for datastream_id, slot in self.slots.items():
+            if self.active[slot]:
+                result.append({
+                    "datastream_id": datastream_id,
+                    "zone": self.zone_names[slot],
+                    "sensor_type": self.sensor_types[slot],
+                    "value": float(self.last_value[slot]),
+                    "ewma": float(self.mean[slot]),
+                    "z_score": float(self.z_score[slot]),
+                    "trend_per_minute": float(self.trend[slot]),
+                    "rapid_rise": bool(self.rate_flag[slot]),
+                })
+        return result
+
+
+anomaly_detector = AnomalyDetector()
+
+
+async def apply_zone_alerts(changed):
+    """
+    Write anomaly state transitions to the zone's anomaly alert slot. Fixed-threshold
+    alerts live in their own slots and outrank it (see zone_state.py). A zone whose
+    write fails stays unwritten and is retried on the next tick.
+    """
+    for zone_name, anomaly in changed.items():
+        try:
+            if anomaly:
+                code, sensor_type = anomaly
+                await set_anomaly_alert(zone_name, code, sensor_type)
+            else:
+                await clear_anomaly_alert(zone_name)
+        except Exception:
+            logger.exception("Failed to write anomaly state for zone '%s', retrying next tick", zone_name)
+            continue
+        anomaly_detector.mark_written(zone_name, anomaly)
+        logger.info("Anomaly state for zone '%s': %s", zone_name, anomaly[0] if anomaly else "cleared")
@@ -0,0 +1,194 @@
+# archive.py
+"""
+Cold tier for old observations.
+
+`archive_old_observations()` moves observations older than ARCHIVE_AFTER_DAYS
+out of Postgres into zstd-compressed Parquet files on local disk, one file
+per day and datastream:
+
+    ARCHIVE_DIR/day=2025-03-01/datastream_id=<uuid>/observations.parquet
+
+Rows are sorted by phenomenon_time and written in row groups of
+ARCHIVE_ROW_GROUP_SIZE, with the numeric reading split out of the result
+JSON into a `value` column. A file is written to a temporary name and
+renamed, and the exported rows (by id) are deleted only after that, so a
+crash never loses data. Rows archived into a day that already has a file
+(late rows, or rows a crash left in the table after the rename) are merged
+into that file by id, so a row is never archived twice.
+
+`read_archive()` serves the archived part of a history request: only the
+day/datastream directories in the range are opened, in day order, only the
+requested columns are read, the phenomenon_time filter skips row groups
+using the Parquet statistics, and the scan stops after `limit` rows.
+
+Only /Observations/history reads the archive. The SensorThings collection
+(/Observations/ with $filter/$orderby) is compiled to a single SQL query and
+covers the last ARCHIVE_AFTER_DAYS days only.
+
+pyarrow is optional; without it archiving is disabled and history reads only
+see the database.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from config import settings
+from db import database
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as pa_dataset
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = ("id", "phenomenon_time", "value", "result", "created_at")
+
+if pa is not None:
+    ARCHIVE_SCHEMA = pa.schema([
+        ("id", pa.string()),
+        ("phenomenon_time", pa.timestamp("us", tz="UTC")),
+        ("value", pa.float64()),
+        ("result", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+archive_state = {"last_run": None, "last_duration_s": None, "rows_archived": 0, "files_written": 0, "error": None}
+
+
+ARCHIVE_FILE = "observations.parquet"
+
+
+def _day_dir(day, datastream_id):
+    # Normalised through uuid.UUID so a datastream id can never leave ARCHIVE_DIR.
+    return os.path.join(settings.ARCHIVE_DIR, f"day={day.isoformat()}", f"datastream_id={uuid.UUID(str(datastream_id))}")
+
+
+def _numeric(result):
+    value = result.get("value") if isinstance(result, dict) else None
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    return None
+
+
+def _write_partition(day, datastream_id, rows):
+    """
+    Blocking: write the day/datastream file (runs in a worker thread). Rows
+    already archived for that day are kept; a row whose id is already in the
+    file is not added again.
+    """
+    directory = _day_dir(day, datastream_id)
+    os.makedirs(directory, exist_ok=True)
+    results = [json.loads(row["result"]) if isinstance(row["result"], str) else row["result"] for row in rows]
+    table = pa.Table.from_pydict({
+        "id": [str(row["id"]) for row in rows],
+        "phenomenon_time": [row["phenomenon_time"] for row in rows],
+        "value": [_numeric(result) for result in results],
+        "result": [json.dumps(result) for result in results],
+        "created_at": [row["created_at"] for row in rows],
+    }, schema=ARCHIVE_SCHEMA)
+    # Earlier files of this day: the current file, and part files written before there was one file per day.
+    existing = sorted(glob.glob(os.path.join(directory, "*.parquet")))
+    if existing:
+        archived = pa_dataset.dataset(existing, format="parquet", schema=ARCHIVE_SCHEMA).to_table()
+        table = table.filter(pc.invert(pc.is_in(table["id"], value_set=archived["id"])))
+        table = pa.concat_tables([archived, table])
+    table = table.sort_by("phenomenon_time")
+    path = os.path.join(directory, ARCHIVE_FILE)
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, compression="zstd", row_group_size=settings.ARCHIVE_ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    for old in existing:
+        if old != path:
+            os.remove(old)
+    return path
+
+
+async def _archive_datastream(datastream_id, cutoff):
+    oldest = await database.fetch_one(
+        query="SELECT MIN(phenomenon_time) AS oldest FROM observation WHERE datastream_id = :ds_id",
+        values={"ds_id": datastream_id},
+    )
+    if not oldest or oldest["oldest"] is None:
+        return
+    day = oldest["oldest"].astimezone(timezone.utc).date()
+    while datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc) < cutoff:
+        start = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc)
+        end = min(start + timedelta(days=1), cutoff)
+        rows = await database.fetch_all(query="""
+            SELECT id, phenomenon_time, result, created_at
+            FROM observation
+            WHERE datastream_id = :ds_id AND phenomenon_time >= :start AND phenomenon_time < :end
+            ORDER BY phenomenon_time
+        """, values={"ds_id": datastream_id, "start": start, "end": end})
+        if rows:
+            await asyncio.to_thread(_write_partition, day, datastream_id, rows)
+            # The file is in place; only now remove exactly the rows it contains.
+            await database.execute(
+                query="DELETE FROM observation WHERE id = ANY(:ids)",
+                values={"ids": [row["id"] for row in rows]},
+            )
+            archive_state["rows_archived"] += len(rows)
+            archive_state["files_written"] += 1
+        day += timedelta(days=1)
+
+
+async def archive_old_observations():
+    if pa is None:
+        return
+    started = time.time()
+    # Whole days only: the hot table always keeps ARCHIVE_AFTER_DAYS complete days.
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    cutoff = today - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    try:
+        rows = await database.fetch_all(query="SELECT id FROM datastream")
+        for row in rows:
+            await _archive_datastream(str(row["id"]), cutoff)
+        archive_state["error"] = None
+    except Exception as e:
+        archive_state["error"] = str(e)
+        logger.error("Error archiving observations: %s", e, exc_info=True)
+    archive_state["last_run"] = started
+    archive_state["last_duration_s"] = round(time.time() - started, 3)
+
+
+def _archive_files(datastream_id, start, end):
+    files = []
+    day = start.astimezone(timezone.utc).date()
+    last_day = (end - timedelta(microseconds=1)).astimezone(timezone.utc).date()
+    while day <= last_day:
+        directory = _day_dir(day, datastream_id)
+        if os.path.isdir(directory):
+            files.extend(sorted(glob.glob(os.path.join(directory, "*.parquet"))))
+        day += timedelta(days=1)
+    return files
+
+
+def _read_archive(datastream_id, start, end, columns, limit):
+    files = _archive_files(datastream_id, start, end)
+    if not files:
+        return []
+    dataset = pa_dataset.dataset(files, format="parquet", schema=ARCHIVE_SCHEMA)
+    time_filter = (pa_dataset.field("phenomenon_time") >= pa.scalar(start, type=ARCHIVE_SCHEMA.field("phenomenon_time").type)) & \
+                  (pa_dataset.field("phenomenon_time") < pa.scalar(end, type=ARCHIVE_SCHEMA.field("phenomenon_time").type))
+    # Column pruning + row-group skipping through the phenomenon_time statistics.
+    # Files are listed in day order and each is sorted by time, so the scan is
+    # in time order and can stop after `limit` rows.
+    scanner = dataset.scanner(columns=list(columns), filter=time_filter)
+    table = scanner.head(limit) if limit is not None else scanner.to_table()
+    return table.to_pylist()
+
+
+async def read_archive(datastream_id, start, end, columns=ARCHIVE_COLUMNS, limit=None):
+    """First `limit` archived observations of one datastream in [start, end), oldest first, as dicts with `columns`."""
+    if pa is None:
+        return []
+    return await asyncio.to_thread(_read_archive, datastream_id, start, end, columns, limit)
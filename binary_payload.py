@@ -0,0 +1,147 @@
+# binary_payload.py
+"""
+Compact binary encoding for batches of sensor readings.
+
+Instead of one JSON document per reading (36-character UUID, key names, unit
+strings), a device registers its datastreams once (POST /handles/) and gets a
+small integer handle for each (ids the server does not know are listed as
+"unknown" and keep using JSON messages). It then publishes any number of readings in a
+single MQTT message on BINARY_TOPIC (or with MQTT 5 content type
+CONTENT_TYPE), little-endian:
+
+    header   version:u8  flags:u8  count:u16  base_time_ms:i64            12 bytes
+    reading  handle:u32  kind:u8   offset_ms:i32  body                    9 bytes + body
+        Heat / Pression / Smoke   value:f64                               (17 bytes)
+        Spark                     value:bool                              (10 bytes)
+        Position                  lat:f64  lng:f64                        (25 bytes)
+
+The kind gives both the sensor type and the body layout, so a reading needs
+no other metadata; units are implied by the sensor type and restored on the
+server so stored results look the same as for JSON messages.
+
+Only the standard library is used, so the simulators import this module too.
+"""
+import json
+import logging
+import struct
+import time
+import urllib.request
+
+BINARY_TOPIC = "iot_safeindustech/sensors/binary"
+CONTENT_TYPE = "application/vnd.safeindustech.readings"
+VERSION = 1
+
+HEADER = struct.Struct("<BBHq")
+READING = struct.Struct("<IBi")
+
+KIND_HEAT = 1
+KIND_PRESSION = 2
+KIND_SPARK = 3
+KIND_SMOKE = 4
+KIND_POSITION = 5
+
+# kind -> sensor_type as used by the ingest path (positions have none)
+SENSOR_TYPES = {
+    KIND_HEAT: "Heat",
+    KIND_PRESSION: "Pression",
+    KIND_SPARK: "Spark",
+    KIND_SMOKE: "Smoke",
+    KIND_POSITION: None,
+}
+KINDS = {sensor_type: kind for kind, sensor_type in SENSOR_TYPES.items() if sensor_type}
+
+BODIES = {
+    KIND_HEAT: struct.Struct("<d"),
+    KIND_PRESSION: struct.Struct("<d"),
+    KIND_SPARK: struct.Struct("<?"),
+    KIND_SMOKE: struct.Struct("<d"),
+    KIND_POSITION: struct.Struct("<dd"),
+}
+
+UNITS = {"Heat": "°C", "Pression": "bar", "Smoke": "ppm"}
+
+MAX_READINGS = 0xFFFF
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def encode(readings, base_time=None):
+    """
+    Pack readings into one message. Each reading is (handle, kind, value, timestamp),
+    value being (lat, lng) for positions and timestamp epoch seconds (None = base time).
+    """
+    readings = list(readings)
+    if len(readings) > MAX_READINGS:
+        raise PayloadError(f"At most {MAX_READINGS} readings per message")
+    base_time = time.time() if base_time is None else base_time
+    base_ms = int(base_time * 1000)
+    parts = [HEADER.pack(VERSION, 0, len(readings), base_ms)]
+    for handle, kind, value, timestamp in readings:
+        offset_ms = 0 if timestamp is None else int(timestamp * 1000) - base_ms
+        parts.append(READING.pack(handle, kind, offset_ms))
+        body = BODIES[kind]
+        parts.append(body.pack(*value) if kind == KIND_POSITION else body.pack(value))
+    return b"".join(parts)
+
+
+def decode(payload):
+    """[(handle, kind, value, timestamp)] with timestamp in epoch seconds."""
+    if len(payload) < HEADER.size:
+        raise PayloadError("Truncated header")
+    version, _flags, count, base_ms = HEADER.unpack_from(payload, 0)
+    if version != VERSION:
+        raise PayloadError(f"Unsupported payload version {version}")
+    readings = []
+    offset = HEADER.size
+    try:
+        for _ in range(count):
+            handle, kind, offset_ms = READING.unpack_from(payload, offset)
+            offset += READING.size
+            body = BODIES.get(kind)
+            if body is None:
+                raise PayloadError(f"Unknown reading kind {kind}")
+            value = body.unpack_from(payload, offset)
+            offset += body.size
+            readings.append((handle, kind, value if kind == KIND_POSITION else value[0], (base_ms + offset_ms) / 1000.0))
+    except struct.error:
+        raise PayloadError(f"Truncated payload: {count} readings announced, {len(readings)} complete")
+    if offset != len(payload):
+        raise PayloadError(f"{len(payload) - offset} trailing bytes")
+    return readings
+
+
+def result_of(kind, value):
+    """The result document a JSON message would have carried."""
+    if kind == KIND_POSITION:
+        return {"lat": value[0], "lng": value[1]}
+    sensor_type = SENSOR_TYPES[kind]
+    if sensor_type in UNITS:
+        return {"value": value, "unit": UNITS[sensor_type]}
+    return {"value": value}
+
+
+def register_handles(api_url, datastream_ids):
+    """
+    Client side: register datastreams once and return {datastream id: handle}.
+    Ids the server does not know are left out, and so is everything when the API
+    cannot be reached; callers send the readings without a handle as JSON.
+    """
+    request = urllib.request.Request(
+        api_url.rstrip("/") + "/handles/",
+        data=json.dumps(list(datastream_ids)).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            body = json.load(response)
+    except (OSError, ValueError) as e:
+        logger.warning("Handle registration at %s failed (%s), sending JSON messages", api_url, e)
+        return {}
+    if body["unknown"]:
+        logger.warning("Unknown datastreams, sent as JSON: %s", ", ".join(body["unknown"]))
+    return {datastream_id: int(handle) for datastream_id, handle in body["handles"].items()}
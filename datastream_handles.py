@@ -0,0 +1,99 @@
+# datastream_handles.py
+"""
+Short numeric handles for datastreams, used by binary payloads (see binary_payload.py).
+
+Handles are assigned by the database (identity column), so they are stable
+across restarts and the same for every client. The mapping is kept in memory
+(loaded during warm-up, extended on registration) so decoding a reading
+normally needs no query. A handle registered through another node or worker
+after warm-up is looked up in datastream_handle on first use and cached. A
+handle that is not found is remembered for HANDLE_NEGATIVE_CACHE_SECONDS, so
+readings with a bogus handle cost one query per handle and period, not one
+per reading.
+"""
+import time
+
+from config import settings
+from db import database
+
+# Past this many remembered unknown handles the negative cache is reset,
+# so random handles cannot grow it without bound.
+MAX_UNKNOWN_HANDLES = 10000
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS datastream_handle (
+        handle        integer GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        datastream_id uuid NOT NULL UNIQUE REFERENCES datastream(id) ON DELETE CASCADE
+    )
+    """,
+]
+
+REGISTER_QUERY = """
+    INSERT INTO datastream_handle (datastream_id)
+    SELECT d.id FROM datastream d
+    WHERE d.id = ANY(CAST(:datastream_ids AS uuid[]))
+    ON CONFLICT (datastream_id) DO NOTHING
+"""
+
+LOOKUP_QUERY = """
+    SELECT handle, datastream_id
+    FROM datastream_handle
+    WHERE datastream_id = ANY(CAST(:datastream_ids AS uuid[]))
+"""
+
+RESOLVE_QUERY = """
+    SELECT handle, datastream_id
+    FROM datastream_handle
+    WHERE handle = :handle
+"""
+
+
+class HandleRegistry:
+    def __init__(self):
+        self.datastream_by_handle = {}   # handle -> datastream id
+        self.handle_by_datastream = {}   # datastream id -> handle
+        self.unknown = {}                # handle -> time until which it is known not to exist
+
+    def _add(self, rows):
+        for row in rows:
+            self.datastream_by_handle[row["handle"]] = str(row["datastream_id"])
+            self.handle_by_datastream[str(row["datastream_id"])] = row["handle"]
+            self.unknown.pop(row["handle"], None)
+
+    async def load(self):
+        self.datastream_by_handle, self.handle_by_datastream = {}, {}
+        self._add(await database.fetch_all(query="SELECT handle, datastream_id FROM datastream_handle"))
+
+    async def register(self, datastream_ids):
+        """Handles for `datastream_ids` (uuid.UUID), assigning new ones where needed; unknown ids are left out."""
+        values = {"datastream_ids": list(datastream_ids)}
+        await database.execute(query=REGISTER_QUERY, values=values)
+        rows = await database.fetch_all(query=LOOKUP_QUERY, values=values)
+        self._add(rows)
+        return {str(row["datastream_id"]): row["handle"] for row in rows}
+
+    async def resolve(self, handle):
+        """Datastream id of a handle, from memory when possible; None if unknown."""
+        datastream_id = self.datastream_by_handle.get(handle)
+        if datastream_id is not None:
+            return datastream_id
+        now = time.monotonic()
+        if self.unknown.get(handle, 0) > now:
+            return None
+        row = await database.fetch_one(query=RESOLVE_QUERY, values={"handle": handle})
+        if not row:
+            if len(self.unknown) >= MAX_UNKNOWN_HANDLES:
+                self.unknown.clear()
+            self.unknown[handle] = now + settings.HANDLE_NEGATIVE_CACHE_SECONDS
+            return None
+        self._add([row])
+        return str(row["datastream_id"])
+
+
+handle_registry = HandleRegistry()
+
+
+async def ensure_schema():
+    for statement in SCHEMA:
+        await database.execute(query=statement)
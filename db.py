@@ -2,4 +2,23 @@
 from databases import Database
 from config import settings
 
-database = Database(settings.DATABASE_URL)
+database = Database(
+    settings.DATABASE_URL,
+    min_size=settings.DB_POOL_MIN_SIZE,
+    max_size=settings.DB_POOL_MAX_SIZE,
+)
+
+
+def pool_free():
+    """Connections the pool can hand out without waiting (idle or not opened yet); None before connect()."""
+    pool = database._backend._pool
+    if pool is None:
+        return None
+    return pool.get_max_size() - pool.get_size() + pool.get_idle_size()
+
+
+def pool_metrics():
+    pool = database._backend._pool
+    if pool is None:
+        return {"max": settings.DB_POOL_MAX_SIZE, "open": 0, "idle": 0, "free": None}
+    return {"max": pool.get_max_size(), "open": pool.get_size(), "idle": pool.get_idle_size(), "free": pool_free()}
@@ -0,0 +1,64 @@
+# employees_router.py
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from db import database
+from position_tracker import position_tracker, simplify, LATEST_POSITIONS_QUERY
+
+employees_router = APIRouter(prefix="/employees", tags=["Employees"])
+
+def _utc(moment):
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+@employees_router.get("/positions")
+async def get_employee_positions():
+    # Latest point of each employee's newest track bucket (one index probe per employee),
+    # overridden by samples received but not flushed yet.
+    rows = await database.fetch_all(query=LATEST_POSITIONS_QUERY)
+    positions = []
+    for row in rows:
+        employee_id = str(row["employee_id"])
+        position, timestamp = None, None
+        if row["bucket_start"] is not None:
+            position = {"lat": row["lat"], "lng": row["lng"]}
+            timestamp = row["bucket_start"] + timedelta(milliseconds=row["offset_ms"])
+        latest = position_tracker.latest.get(employee_id)
+        if latest and (timestamp is None or latest[2] >= timestamp):
+            position, timestamp = {"lat": latest[0], "lng": latest[1]}, latest[2]
+        positions.append({
+            "employee_id": row["employee_id"],
+            "name": row["name"],
+            "position": position,
+            "timestamp": timestamp
+        })
+    return positions
+
+@employees_router.get("/{employee_id}/trajectory")
+async def get_employee_trajectory(
+    employee_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    tolerance: float = Query(2.0, ge=0, description="Simplification tolerance in metres (0 = raw track)"),
+):
+    end = _utc(end) if end else datetime.now(timezone.utc)
+    start = _utc(start) if start else end - timedelta(hours=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    times, lats, lngs = await position_tracker.track(employee_id, start, end)
+    keep = simplify(lats, lngs, tolerance)
+    return {
+        "employee_id": employee_id,
+        "start": start,
+        "end": end,
+        "tolerance_m": tolerance,
+        "raw_points": int(times.size),
+        "points": [
+            {
+                "lat": float(lats[i]),
+                "lng": float(lngs[i]),
+                "timestamp": datetime.fromtimestamp(float(times[i]), tz=timezone.utc),
+            }
+            for i in keep
+        ],
+    }
@@ -0,0 +1,60 @@
+# endpoint_queries.py
+"""
+SQL run by the endpoints in main.py.
+
+Kept in a module with no import side effects (main.py configures logging and
+builds the app), so perf_regression.py can time exactly what the endpoints run.
+"""
+
+LATEST_OBSERVATION_QUERY = """
+    SELECT result, phenomenon_time
+    FROM observation
+    WHERE datastream_id = :datastream_id
+    ORDER BY phenomenon_time DESC
+    LIMIT 1
+"""
+
+ZONES_STATUS_QUERY = """
+    SELECT 
+        z.name, 
+        z.risk_level, 
+        z.properties,
+        -- Latest Temperature
+        (SELECT o.result->>'value'
+         FROM observation o
+         JOIN datastream d ON o.datastream_id = d.id
+         WHERE d.feature_of_interest_id = z.feature_of_interest_id
+         AND d.name ILIKE '%Heat%'
+         ORDER BY o.phenomenon_time DESC
+         LIMIT 1) AS current_temp,
+        
+        -- Latest Pressure
+        (SELECT o.result->>'value'
+         FROM observation o
+         JOIN datastream d ON o.datastream_id = d.id
+         WHERE d.feature_of_interest_id = z.feature_of_interest_id
+         AND d.name ILIKE '%Pression%'
+         ORDER BY o.phenomenon_time DESC
+         LIMIT 1) AS current_pressure,
+
+        -- Latest Smoke
+        (SELECT o.result->>'value'
+         FROM observation o
+         JOIN datastream d ON o.datastream_id = d.id
+         WHERE d.feature_of_interest_id = z.feature_of_interest_id
+         AND d.name ILIKE '%Smoke%'
+         ORDER BY o.phenomenon_time DESC
+         LIMIT 1) AS current_smoke,
+
+        -- Latest Spark Detection (a few legacy spark rows hold numbers; those read as NULL)
+        (SELECT CASE jsonb_typeof(o.result->'value') WHEN 'boolean' THEN (o.result->>'value')::BOOLEAN END
+         FROM observation o
+         JOIN datastream d ON o.datastream_id = d.id
+         WHERE d.feature_of_interest_id = z.feature_of_interest_id
+         AND d.name ILIKE '%Spark%'
+         ORDER BY o.phenomenon_time DESC
+         LIMIT 1) AS spark_detected
+
+    FROM zone z
+    WHERE z.name IN ('Production', 'Stock', 'Reception', 'Security', 'Administration', 'Monitoring');  -- 🔥 Filter to 6 zones
+"""
@@ -0,0 +1,23 @@
+# handles_router.py
+import uuid
+from typing import List
+from fastapi import APIRouter, Body, HTTPException
+from datastream_handles import handle_registry
+
+handles_router = APIRouter(prefix="/handles", tags=["Handles"])
+
+@handles_router.get("/")
+async def get_handles():
+    return handle_registry.handle_by_datastream
+
+@handles_router.post("/")
+async def register_handles(datastream_ids: List[str] = Body(...)):
+    # Idempotent: a datastream keeps its handle, so devices can register on every start.
+    try:
+        ids = [uuid.UUID(datastream_id) for datastream_id in datastream_ids]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="datastream ids must be UUIDs")
+    handles = await handle_registry.register(ids)
+    # Unknown ids do not fail the batch: a device with one stale id still gets the others.
+    unknown = [str(datastream_id) for datastream_id in ids if str(datastream_id) not in handles]
+    return {"handles": handles, "unknown": unknown}
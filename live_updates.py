@@ -0,0 +1,172 @@
+# live_updates.py
+"""
+Fan-out of ingested observations to WebSocket subscribers.
+
+Each connection subscribes to datastream ids, zone names and/or sensor
+types. The ingest path (mqtt_client.apply_reading) calls `hub.publish()`,
+which never awaits: it looks up the matching connections through per-key
+indexes and stores the frame in
+each connection's pending map keyed by datastream id. A newer reading for the
+same datastream replaces the unsent one (conflation), so a slow client
+receives the latest value per datastream instead of a growing backlog. The
+pending map is capped at WS_MAX_PENDING datastreams; each connection drains
+it from its own sender task, and a client that cannot take a frame within
+WS_SEND_TIMEOUT_SECONDS is disconnected.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.datastreams = set()
+        self.zones = set()
+        self.sensor_types = set()
+        self.pending = OrderedDict()   # datastream_id -> latest unsent frame
+        self.ready = asyncio.Event()
+        self.dropped = 0               # frames evicted by the pending cap
+
+    def push(self, key, frame):
+        if key in self.pending:
+            # Conflate: keep the latest value, move it to the back of the queue.
+            del self.pending[key]
+        elif len(self.pending) >= settings.WS_MAX_PENDING:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.pending[key] = frame
+        self.ready.set()
+
+    def take(self):
+        frames = list(self.pending.values())
+        self.pending.clear()
+        self.ready.clear()
+        return frames
+
+
+class LiveUpdateHub:
+    def __init__(self):
+        self.by_datastream = {}
+        self.by_zone = {}
+        self.by_sensor_type = {}
+
+    def _indexes(self, subscriber):
+        return (
+            (self.by_datastream, subscriber.datastreams),
+            (self.by_zone, subscriber.zones),
+            (self.by_sensor_type, subscriber.sensor_types),
+        )
+
+    def subscribe(self, subscriber, datastreams=(), zones=(), sensor_types=()):
+        self.unsubscribe(subscriber)
+        subscriber.datastreams = {str(d) for d in datastreams}
+        subscriber.zones = set(zones)
+        subscriber.sensor_types = set(sensor_types)
+        for index, keys in self._indexes(subscriber):
+            for key in keys:
+                index.setdefault(key, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        for index, keys in self._indexes(subscriber):
+            for key in keys:
+                members = index.get(key)
+                if members:
+                    members.discard(subscriber)
+                    if not members:
+                        del index[key]
+
+    def publish(self, datastream_id, zone_name, sensor_type, result, timestamp):
+        """Called from the ingest path; never blocks."""
+        datastream_id = str(datastream_id)
+        targets = set()
+        for index, key in (
+            (self.by_datastream, datastream_id),
+            (self.by_zone, zone_name),
+            (self.by_sensor_type, sensor_type),
+        ):
+            if key is not None and key in index:
+                targets |= index[key]
+        if not targets:
+            return
+        frame = {
+            "datastream_id": datastream_id,
+            "zone": zone_name,
+            "sensor_type": sensor_type,
+            "result": result,
+            "timestamp": timestamp,
+        }
+        for subscriber in targets:
+            subscriber.push(datastream_id, frame)
+
+
+hub = LiveUpdateHub()
+
+
+def _subscription(message):
+    return (
+        message.get("datastreams") or [],
+        message.get("zones") or [],
+        message.get("sensor_types") or [],
+    )
+
+
+async def _sender(subscriber):
+    while True:
+        await subscriber.ready.wait()
+        frames = subscriber.take()
+        await asyncio.wait_for(
+            subscriber.websocket.send_json(frames),
+            timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+        )
+
+
+async def serve_subscriber(websocket: WebSocket, datastreams=(), zones=(), sensor_types=()):
+    """
+    Run one subscription connection. The client may (re)subscribe at any time
+    by sending {"datastreams": [...], "zones": [...], "sensor_types": [...]}.
+    """
+    subscriber = Subscriber(websocket)
+    hub.subscribe(subscriber, datastreams, zones, sensor_types)
+    sender = asyncio.create_task(_sender(subscriber))
+    try:
+        while True:
+            receive = asyncio.create_task(websocket.receive_json())
+            done, _ = await asyncio.wait({receive, sender}, return_when=asyncio.FIRST_COMPLETED)
+            if sender in done:
+                receive.cancel()
+                # Re-raises the send timeout / disconnect of a slow or gone client.
+                sender.result()
+            try:
+                message = receive.result()
+            except ValueError:
+                continue  # not JSON; ignore
+            if isinstance(message, dict):
+                hub.subscribe(subscriber, *_subscription(message))
+                # Acknowledge through the sender task so only one task ever writes to the socket.
+                subscriber.push("__subscription__", {
+                    "subscribed": {
+                        "datastreams": sorted(subscriber.datastreams),
+                        "zones": sorted(subscriber.zones),
+                        "sensor_types": sorted(subscriber.sensor_types),
+                    }
+                })
+    except asyncio.TimeoutError:
+        # Could not take a frame in time: drop the client rather than buffer for it.
+        try:
+            await websocket.close(code=1013)
+        except RuntimeError:
+            pass
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        hub.unsubscribe(subscriber)
+        sender.cancel()
+        if subscriber.dropped:
+            logger.info("WebSocket subscriber closed after dropping %d conflated frames", subscriber.dropped)
@@ -0,0 +1,155 @@
+# logging_config.py
+"""
+Non-blocking structured logging for the ingest path and the API.
+
+Modules log through the standard `logging` API (`logger = logging.getLogger(__name__)`,
+%-style arguments). `configure_logging()` installs a single handler on the root
+logger that only puts the record on a bounded queue; a QueueListener thread
+formats each record as one JSON line and writes it to stdout. The event loop
+therefore never waits for stdout: when the writer falls behind and the queue
+is full, records are dropped and counted instead of blocking ingest.
+
+Each message template (logger + format string, not the formatted text) may
+emit at most LOG_RATE_LIMIT_PER_SECOND records per second; the rest are
+suppressed and the count is reported on the next line that gets through
+(`"suppressed": n`). Only records up to LOG_RATE_LIMIT_MAX_LEVEL (INFO by
+default) are limited: warnings and errors always get through. Per-message lines are DEBUG, so at the default INFO
+level they cost a single level check.
+
+Levels come from LOG_LEVEL / LOG_LEVELS at startup and can be changed at
+runtime through set_level() (PUT /logging/levels/{logger}).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import traceback
+from datetime import datetime, timezone
+
+from config import settings
+
+# Attributes every LogRecord has; anything else came in through `extra=` and is emitted as a field.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "suppressed"}
+
+log_state = {"dropped": 0, "suppressed": 0}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """At most `per_second` records per message template and second, for levels up to `max_level`."""
+
+    def __init__(self, per_second, max_level=logging.INFO):
+        super().__init__()
+        self.per_second = per_second
+        self.max_level = max_level
+        self.windows = {}   # (logger, template) -> [window start second, emitted, suppressed]
+
+    def filter(self, record):
+        if self.per_second <= 0 or record.levelno > self.max_level:
+            return True
+        key = (record.name, record.msg)
+        second = int(record.created)
+        window = self.windows.get(key)
+        if window is None or window[0] != second:
+            suppressed = window[2] if window else 0
+            self.windows[key] = [second, 1, 0]
+            record.suppressed = suppressed
+            return True
+        if window[1] < self.per_second:
+            window[1] += 1
+            return True
+        window[2] += 1
+        log_state["suppressed"] += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Formatting (message interpolation, tracebacks, JSON) happens on the writer thread.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_state["dropped"] += 1
+
+
+_listener = None
+
+
+def _parse_levels(spec):
+    """'mqtt_client=DEBUG,archive=WARNING' -> {'mqtt_client': 'DEBUG', 'archive': 'WARNING'}"""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Install the queue handler on the root logger and start the writer thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(RateLimitFilter(settings.LOG_RATE_LIMIT_PER_SECOND,
+                                      logging.getLevelName(settings.LOG_RATE_LIMIT_MAX_LEVEL.upper())))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in _parse_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def shutdown_logging():
+    """Stop the writer thread after it has written everything still queued."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def set_level(name, level):
+    """Change a logger's level at runtime; `root` addresses the root logger."""
+    level = level.upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Unknown log level: {level}")
+    logging.getLogger(None if name == "root" else name).setLevel(level)
+
+
+def levels():
+    loggers = {"root": logging.getLevelName(logging.getLogger().level)}
+    for name, logger in sorted(logging.root.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            loggers[name] = logging.getLevelName(logger.level)
+    return {"levels": loggers, **log_state, "queued": _listener.queue.qsize() if _listener else 0}
@@ -1,23 +1,49 @@
 # main.py
 import asyncio
 import json
+import logging
+import time
 import uuid
 import uvicorn
-from fastapi import FastAPI, WebSocket, APIRouter
+from typing import List
+from fastapi import FastAPI, WebSocket, APIRouter, Query
 from fastapi.middleware.cors import CORSMiddleware
 from db import database
-from mqtt_client import start_mqtt_listener
+from mqtt_client import start_mqtt_listener, flush_families, topic_registry
 from config import settings
 from fastapi_utils.tasks import repeat_every
 from sensors_router import sensors_router
 from observed_properties_router import observed_properties_router
 from observations_router import observations_router
 from alerts_router import alerts_router
+from stats_router import stats_router
+from employees_router import employees_router
+from handles_router import handles_router
+from window_stats import window_stats
+from anomaly_detector import anomaly_detector, apply_zone_alerts
+from live_updates import serve_subscriber
+from metadata_cache import metadata_cache
+from warmup import warm_up_with_retry, readiness
+from position_tracker import position_tracker, ensure_schema as ensure_position_schema
+from datastream_handles import ensure_schema as ensure_handle_schema
+from archive import archive_old_observations
+from admission import AdmissionControlMiddleware, admission_metrics, admitted, Shed
+from zone_state import ensure_schema, ACTIVE_ALERTS_QUERY, ALL_ZONES_QUERY, properties_of, alert_of
+from endpoint_queries import LATEST_OBSERVATION_QUERY, ZONES_STATUS_QUERY
 from fastapi import HTTPException
+from logging_config import configure_logging, shutdown_logging, set_level, levels
+
+# JSON lines written by a background thread; never blocks the event loop (see logging_config.py)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 
 app = FastAPI()
 
+# Priority classes with their own concurrency limits; low-priority work is shed first (see admission.py).
+# Added before CORS so that CORS wraps it and 503 responses still carry CORS headers.
+app.add_middleware(AdmissionControlMiddleware)
+
 # Allow CORS for development
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +55,10 @@ app.add_middleware(
 app.include_router(sensors_router)
 app.include_router(observed_properties_router)
 app.include_router(observations_router)
+app.include_router(alerts_router)
+app.include_router(stats_router)
+app.include_router(employees_router)
+app.include_router(handles_router)
 
 
 
@@ -45,25 +75,70 @@ async def get_usine():
 @app.on_event("startup")
 async def startup_event():
     await database.connect()
+    await ensure_schema()
+    await ensure_position_schema()
+    await ensure_handle_schema()
+    logger.info("Database connected.")
+    # Ingest waits for warm-up in the background, so the API (and /ready) are served meanwhile.
+    asyncio.get_event_loop().create_task(start_after_warm_up())
+
+async def start_after_warm_up():
+    # Open/prime the pool and load metadata before the first message arrives;
+    # retried until it succeeds, and only then is the MQTT listener started.
+    await warm_up_with_retry()
     start_mqtt_listener()
-    print("Database connected and MQTT listener started.")
+    logger.info("MQTT listener started.")
+
+# Readiness probe for the load balancer: 503 until warm-up is done and MQTT is subscribed.
+@app.get("/ready")
+async def get_ready():
+    ready, details = readiness()
+    if not ready:
+        raise HTTPException(status_code=503, detail=details)
+    return details
+
+@app.get("/metrics/admission")
+async def get_admission_metrics():
+    return admission_metrics()
+
+# Messages dispatched per topic family and messages rejected for having no handler
+@app.get("/metrics/ingest")
+async def get_ingest_metrics():
+    return topic_registry.metrics()
+
+# Runtime log levels, e.g. PUT /logging/levels/mqtt_client?level=DEBUG to see per-message lines
+@app.get("/logging/levels")
+async def get_log_levels():
+    return levels()
+
+@app.put("/logging/levels/{logger_name}")
+async def put_log_level(logger_name: str, level: str):
+    try:
+        set_level(logger_name, level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return levels()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Buffered readings of every sensor family, including employee positions
+    await flush_families()
     await database.disconnect()
-    print("Database disconnected.")
+    logger.info("Database disconnected.")
+    shutdown_logging()
 
 # REST endpoint: Get the latest observation for a given datastream ID.
 @app.get("/observations/{datastream_id}")
 async def get_latest_observation(datastream_id: str):
-    query = """
-        SELECT result, phenomenon_time
-        FROM observation
-        WHERE datastream_id = :datastream_id
-        ORDER BY phenomenon_time DESC
-        LIMIT 1
-    """
-    row = await database.fetch_one(query=query, values={"datastream_id": datastream_id})
+    # Served from memory once warm-up has loaded the latest values (ingest keeps them current)
+    latest = metadata_cache.get_latest(datastream_id)
+    if latest:
+        return {
+            "datastream_id": datastream_id,
+            "result": latest["result"],
+            "timestamp": latest["phenomenon_time"].isoformat()
+        }
+    row = await database.fetch_one(query=LATEST_OBSERVATION_QUERY, values={"datastream_id": datastream_id})
     if row:
         return {
             "datastream_id": datastream_id,
@@ -73,91 +148,9 @@ async def get_latest_observation(datastream_id: str):
     return {"message": "No observation found."}
 
 # REST endpoint: Get zone status (e.g., alerts) for all zones.
-
-@app.get("/employees/positions")
-async def get_employee_positions():
-    # This query retrieves the latest observation for each employee's position datastream.
-    query = """
-        WITH latest_obs AS (
-            SELECT d.id AS ds_id, MAX(o.phenomenon_time) AS max_time
-            FROM observation o
-            JOIN datastream d ON o.datastream_id = d.id
-            GROUP BY d.id
-        )
-        SELECT 
-            e.id AS employee_id, 
-            e.name, 
-            o.result AS position, 
-            o.phenomenon_time AS timestamp
-        FROM employee e
-        -- We assume that the Thing name is exactly 'Employee Tracker - ' concatenated with the employee name.
-        JOIN thing t ON t.name = 'Employee Tracker - ' || e.name
-        JOIN datastream d ON d.thing_id = t.id
-        JOIN latest_obs lo ON lo.ds_id = d.id
-        JOIN observation o ON o.datastream_id = d.id AND o.phenomenon_time = lo.max_time
-        ORDER BY e.name;
-    """
-    
-    rows = await database.fetch_all(query=query)
-    positions = []
-    for row in rows:
-        positions.append({
-            "employee_id": row["employee_id"],
-            "name": row["name"],
-            "position": json.loads(row["position"]) if row["position"] else None,
-            "timestamp": row["timestamp"]
-        })
-    
-    return positions
-
 @app.get("/zones/status")
-async def get_zones_status():
-    query = """
-        SELECT 
-            z.name, 
-            z.risk_level, 
-            z.properties,
-            -- Latest Temperature
-            (SELECT o.result->>'value'
-             FROM observation o
-             JOIN datastream d ON o.datastream_id = d.id
-             WHERE d.feature_of_interest_id = z.feature_of_interest_id
-             AND d.name ILIKE '%Heat%'
-             ORDER BY o.phenomenon_time DESC
-             LIMIT 1) AS current_temp,
-            
-            -- Latest Pressure
-            (SELECT o.result->>'value'
-             FROM observation o
-             JOIN datastream d ON o.datastream_id = d.id
-             WHERE d.feature_of_interest_id = z.feature_of_interest_id
-             AND d.name ILIKE '%Pression%'
-             ORDER BY o.phenomenon_time DESC
-             LIMIT 1) AS current_pressure,
-
-            -- Latest Smoke
-            (SELECT o.result->>'value'
-             FROM observation o
-             JOIN datastream d ON o.datastream_id = d.id
-             WHERE d.feature_of_interest_id = z.feature_of_interest_id
-             AND d.name ILIKE '%Smoke%'
-             ORDER BY o.phenomenon_time DESC
-             LIMIT 1) AS current_smoke,
-
-            -- Latest Spark Detection
-            (SELECT (o.result->>'value')::BOOLEAN
-             FROM observation o
-             JOIN datastream d ON o.datastream_id = d.id
-             WHERE d.feature_of_interest_id = z.feature_of_interest_id
-             AND d.name ILIKE '%Spark%'
-             ORDER BY o.phenomenon_time DESC
-             LIMIT 1) AS spark_detected
-
-        FROM zone z
-        WHERE z.name IN ('Production', 'Stock', 'Reception', 'Security', 'Administration', 'Monitoring');  -- 🔥 Filter to 6 zones
-    """
-
-    rows = await database.fetch_all(query)
+async def get_zones_status(include_stats: bool = False):
+    rows = await database.fetch_all(query=ZONES_STATUS_QUERY)
     
     zones_status = []
     
@@ -172,80 +165,116 @@ async def get_zones_status():
             "alert": "Temperature exceeds threshold" if row["current_temp"] and float(row["current_temp"]) > TEMPERATURE_THRESHOLD else None
         }
         
-        zones_status.append({
+        zone_status = {
             "name": row["name"],
             "risk_level": row["risk_level"],
             "properties": properties
-        })
+        }
+        if include_stats:
+            # Rolling 1m/5m/60m windows from memory, see window_stats.py
+            zone_status["stats"] = window_stats.zone_stats(row["name"])
+        zones_status.append(zone_status)
     
     return zones_status
+# One ALL_ZONES_QUERY per second however many /ws/zones clients are connected, run as "normal"
+# work (see admission.py); while it is shed, clients keep getting the previous snapshot.
+zones_snapshot = {"at": 0.0, "zones": None}
+zones_snapshot_lock = asyncio.Lock()
+
+async def current_zones():
+    async with zones_snapshot_lock:
+        if time.monotonic() - zones_snapshot["at"] >= 1.0:
+            try:
+                async with admitted("normal"):
+                    rows = await database.fetch_all(query=ALL_ZONES_QUERY)
+                zones_snapshot["zones"] = [{
+                    "id": row["id"],
+                    "name": row["name"],
+                    "heat": row["current_heat"] if row["current_heat"] is not None else "N/A",
+                    "pression": row["current_pression"] if row["current_pression"] is not None else "N/A",
+                    "spark": row["current_spark"] if row["current_spark"] is not None else "N/A",
+                    "smoke": row["current_smoke"] if row["current_smoke"] is not None else "N/A",
+                    "alert": row["alert_message"] or "None"
+                } for row in rows]
+            except Shed as e:
+                logger.debug("Zones poll shed (%s)", e.reason)
+            zones_snapshot["at"] = time.monotonic()
+    return zones_snapshot["zones"]
+
 @app.websocket("/ws/zones")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     while True:
-        query = """
-            SELECT id, name, properties
-            FROM zone
-        """
-        rows = await database.fetch_all(query=query)
-        zones = []
-        for row in rows:
-            properties = json.loads(row["properties"]) if row["properties"] else {}
-            zones.append({
-                "id": row["id"],
-                "name": row["name"],
-                "heat": properties.get("current_heat", "N/A"),
-                "pression": properties.get("current_pression", "N/A"),
-                "spark": properties.get("current_spark", "N/A"),
-                "smoke": properties.get("current_smoke", "N/A"),
-                "alert": properties.get("alert", "None")
-            })
-        await websocket.send_json(zones)
+        zones = await current_zones()
+        if zones is not None:
+            await websocket.send_json(zones)
         await asyncio.sleep(1)
 
-# Endpoint: Return zones that are in alarm (i.e. have an alert in properties)
+# Endpoint: Return zones that are in alarm (active alert in zone_state, read through its partial index)
 @app.get("/alarms")
 async def get_alarms():
-    query = """
-        SELECT z.name AS zone_name, z.risk_level, z.properties
-        FROM zone z
-        WHERE z.properties->>'alert' IS NOT NULL
-        ORDER BY z.name
-    """
-    rows = await database.fetch_all(query=query)
+    rows = await database.fetch_all(query=ACTIVE_ALERTS_QUERY)
     alarms = []
     for row in rows:
-        properties = json.loads(row["properties"]) if row["properties"] else {}
         alarms.append({
-            "name": row["zone_name"],
+            "name": row["name"],
             "risk_level": row["risk_level"],
-            "properties": properties,
+            "properties": properties_of(row),
+            "alert": alert_of(row),
         })
     return alarms
 
 
-# WebSocket endpoint: Stream the latest observation for a given datastream.
+# WebSocket endpoint: Stream the latest observation for subscribed datastreams, zones or sensor types.
+# Initial subscription comes from the query string (?datastream_id=..&zone=..&sensor_type=..);
+# the client can change it later by sending {"datastreams": [...], "zones": [...], "sensor_types": [...]}.
+@app.websocket("/ws/observations")
+async def websocket_observations(
+    websocket: WebSocket,
+    datastream_id: List[str] = Query([]),
+    zone: List[str] = Query([]),
+    sensor_type: List[str] = Query([]),
+):
+    await websocket.accept()
+    await serve_subscriber(websocket, datastream_id, zone, sensor_type)
 
 # Background task: Periodically check the latest temperature and trigger alerts if needed.
 @app.on_event("startup")
 @repeat_every(seconds=10)  # Check every 10 seconds.
 async def check_temperature_threshold():
-    query = """
-        SELECT result, phenomenon_time
-        FROM observation
-        WHERE datastream_id = :datastream_id
-        ORDER BY phenomenon_time DESC
-        LIMIT 1
-    """
-    row = await database.fetch_one(query=query, values={"datastream_id": settings.TEMP_DATASTREAM_ID})
+    row = await database.fetch_one(query=LATEST_OBSERVATION_QUERY, values={"datastream_id": settings.TEMP_DATASTREAM_ID})
     if row:
         result = json.loads(row["result"])
         temperature_value = result.get("value")
         if temperature_value and float(temperature_value) > 70:
-            print(f"Background Task ALERT: Temperature {temperature_value}°C exceeds threshold!")
+            logger.warning("Background Task ALERT: Temperature %s°C exceeds threshold!", temperature_value)
             await mqtt_client.trigger_temperature_alert(settings.TEMP_DATASTREAM_ID, float(temperature_value))
 
 
+# Background task: fold queued readings into the anomaly detector (vectorized over all datastreams)
+# and push zone alert transitions to the database (unwritten ones are retried every tick).
+@app.on_event("startup")
+@repeat_every(seconds=settings.ANOMALY_TICK_SECONDS, logger=logger)
+async def run_anomaly_detection():
+    changed = anomaly_detector.tick()
+    if changed:
+        await apply_zone_alerts(changed)
+
+# Background task: write buffered employee positions to their track buckets.
+@app.on_event("startup")
+@repeat_every(seconds=settings.TRACK_FLUSH_SECONDS)
+async def flush_position_tracks():
+    try:
+        await position_tracker.flush()
+    except Exception:
+        # Unwritten samples stay buffered for the next flush (see PositionTracker.flush)
+        logger.exception("Position track flush failed")
+
+# Background task: move observations older than ARCHIVE_AFTER_DAYS to the Parquet cold tier.
+@app.on_event("startup")
+@repeat_every(seconds=settings.ARCHIVE_INTERVAL_SECONDS)
+async def archive_observations():
+    await archive_old_observations()
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,82 @@
+# metadata_cache.py
+"""
+In-process copy of the slowly-changing catalog (datastreams with their zone,
+zones, sensors) and of the latest reading per datastream.
+
+Loaded once during warm-up (see warmup.py) and kept current by the ingest
+path, so hot lookups do not need a database round trip.
+"""
+import json
+
+from db import database
+
+
+def _json(value):
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class MetadataCache:
+    def __init__(self):
+        self.datastreams = {}   # datastream id -> {name, sensor_id, feature_of_interest_id, zone_id, zone_name}
+        self.zones = {}         # zone id -> {name, risk_level, feature_of_interest_id}
+        self.sensors = {}       # sensor id -> {name, thing_id}
+        self.latest = {}        # datastream id -> {"result": ..., "phenomenon_time": datetime}
+        self.loaded = False
+
+    async def load(self):
+        datastream_rows = await database.fetch_all(query="""
+            SELECT DISTINCT ON (d.id)
+                d.id, d.name, d.sensor_id, d.feature_of_interest_id,
+                z.id AS zone_id, z.name AS zone_name
+            FROM datastream d
+            LEFT JOIN zone z ON z.feature_of_interest_id = d.feature_of_interest_id
+            ORDER BY d.id, z.name
+        """)
+        zone_rows = await database.fetch_all(query="SELECT id, name, risk_level, feature_of_interest_id FROM zone")
+        sensor_rows = await database.fetch_all(query="SELECT id, name, thing_id FROM sensor")
+        # One index probe per datastream instead of a scan over the whole observation table.
+        latest_rows = await database.fetch_all(query="""
+            SELECT d.id AS datastream_id, o.result, o.phenomenon_time
+            FROM datastream d
+            CROSS JOIN LATERAL (
+                SELECT result, phenomenon_time
+                FROM observation
+                WHERE datastream_id = d.id
+                ORDER BY phenomenon_time DESC
+                LIMIT 1
+            ) o
+        """)
+
+        self.datastreams = {
+            str(row["id"]): {
+                "name": row["name"],
+                "sensor_id": str(row["sensor_id"]) if row["sensor_id"] else None,
+                "feature_of_interest_id": str(row["feature_of_interest_id"]) if row["feature_of_interest_id"] else None,
+                "zone_id": str(row["zone_id"]) if row["zone_id"] else None,
+                "zone_name": row["zone_name"],
+            }
+            for row in datastream_rows
+        }
+        self.zones = {
+            str(row["id"]): {
+                "name": row["name"],
+                "risk_level": row["risk_level"],
+                "feature_of_interest_id": str(row["feature_of_interest_id"]) if row["feature_of_interest_id"] else None,
+            }
+            for row in zone_rows
+        }
+        self.sensors = {str(row["id"]): {"name": row["name"], "thing_id": str(row["thing_id"])} for row in sensor_rows}
+        self.latest = {
+            str(row["datastream_id"]): {"result": _json(row["result"]), "phenomenon_time": row["phenomenon_time"]}
+            for row in latest_rows
+        }
+        self.loaded = True
+
+    def set_latest(self, datastream_id, result, phenomenon_time):
+        self.latest[str(datastream_id)] = {"result": result, "phenomenon_time": phenomenon_time}
+
+    def get_latest(self, datastream_id):
+        return self.latest.get(str(datastream_id))
+
+
+metadata_cache = MetadataCache()
@@ -1,223 +1,351 @@
 import asyncio
 import json
+import logging
+import time
 import uuid
-from aiomqtt import Client as MQTTClient
+from datetime import datetime, timezone
+from aiomqtt import Client as MQTTClient, ProtocolVersion
 from config import settings
 from db import database
+from window_stats import window_stats
+from anomaly_detector import anomaly_detector
+from live_updates import hub
+from metadata_cache import metadata_cache
+from zone_state import record_reading
+from position_tracker import position_tracker
+from datastream_handles import handle_registry
+from topic_dispatch import TopicRegistry
+from binary_payload import BINARY_TOPIC, CONTENT_TYPE, KIND_POSITION, SENSOR_TYPES, PayloadError, decode, result_of
 
-# Define thresholds for alerting
-HEAT_THRESHOLD = 70  # °C
+logger = logging.getLogger(__name__)
+
+# Thresholds for alerts (example values)
+HEAT_THRESHOLD = 70       # °C
 PRESSION_THRESHOLD = 5.0  # bar
-SPARK_DETECTED = True  # Sparks are a direct alarm trigger
-SMOKE_THRESHOLD = 5.0  # ppm
+SMOKE_THRESHOLD = 5.0     # ppm
+# For Spark, we assume a True value triggers an alert
 
-async def process_message(message):
-    try:
-        payload_str = message.payload.decode("utf-8")
-        data = json.loads(payload_str)
+# Statements run for every batch (warmup.py primes them on each pool connection).
+# phenomenon_time is the receive time (JSON families) or the device timestamp (binary).
+INSERT_OBSERVATIONS_QUERY = """
+    INSERT INTO observation (id, datastream_id, phenomenon_time, result, created_at)
+    SELECT obs_id, ds_id, phenomenon_time, result, NOW()
+    FROM unnest(CAST(:obs_ids AS uuid[]), CAST(:ds_ids AS uuid[]),
+                CAST(:phenomenon_times AS timestamptz[]), CAST(:results AS jsonb[]))
+        AS batch(obs_id, ds_id, phenomenon_time, result)
+"""
+# The join is based on the common FoI; both the datastream and the zone should share the same feature_of_interest_id.
+# Only needed for datastreams the metadata cache does not know yet.
+ZONE_LOOKUP_QUERY = """
+    SELECT z.id, z.name
+    FROM zone z
+    JOIN datastream d ON d.feature_of_interest_id = z.feature_of_interest_id
+    WHERE d.id = :ds_id
+    LIMIT 1
+"""
 
-        datastream_id = data["datastream_id"]
-        result = data["result"]  # e.g., {"value": 21.7, "unit": "°C"}
-        sensor_type = data.get("sensor_type")  # Identify which sensor
+# Read by /ready: True while the broker subscription is live (mqtt_listener reconnects when it drops)
+mqtt_state = {"subscribed": False, "subscribed_at": None, "reconnects": 0, "last_error": None}
 
-        if not sensor_type:
-            print(f"Warning: Sensor type not provided in {data}")
-            return
+async def resolve_zone(datastream_id):
+    """(zone id, zone name) of a datastream, from the metadata cache when possible."""
+    datastream = metadata_cache.datastreams.get(datastream_id)
+    if datastream and datastream["zone_id"]:
+        return datastream["zone_id"], datastream["zone_name"]
+    row = await database.fetch_one(query=ZONE_LOOKUP_QUERY, values={"ds_id": uuid.UUID(datastream_id)})
+    if not row:
+        return None
+    zone = (str(row["id"]), row["name"])
+    metadata_cache.datastreams.setdefault(datastream_id, {}).update(zone_id=zone[0], zone_name=zone[1])
+    return zone
 
-        value = float(result.get("value", 0))
-
-        # Insert observation into database
-        insert_query = """
-            INSERT INTO observation (id, datastream_id, phenomenon_time, result, created_at)
-            VALUES (:obs_id, :ds_id, NOW(), CAST(:result_text AS jsonb), NOW())
-        """
-        insert_values = {
-            "obs_id": uuid.uuid4(),
-            "ds_id": uuid.UUID(datastream_id),
-            "result_text": json.dumps(result)
-        }
-        await database.execute(query=insert_query, values=insert_values)
-        print(f"Inserted {sensor_type} observation for datastream {datastream_id}")
-
-        # Fetch corresponding zone based on Feature of Interest
-        zone_query = """
-            SELECT z.id, z.name, z.properties 
-            FROM zone z
-            JOIN datastream d ON d.feature_of_interest_id = z.feature_of_interest_id
-            WHERE d.id = :ds_id
-            LIMIT 1
-        """
-        zone = await database.fetch_one(query=zone_query, values={"ds_id": uuid.UUID(datastream_id)})
-
-        if zone:
-            zone_id = str(zone["id"])
-            zone_name = zone["name"]
-            properties = zone["properties"] or {}
-
-            # Default: No alert
-            alert = None
-
-            # Update zone properties based on sensor type
-            if sensor_type == "Heat":
-                properties["current_heat"] = value
-                if value > HEAT_THRESHOLD:
-                    alert = "High Temperature Detected!"
-            elif sensor_type == "Pression":
-                properties["current_pression"] = value
-                if value > PRESSION_THRESHOLD:
-                    alert = "Pressure Exceeds Safe Levels!"
-            elif sensor_type == "Spark":
-                properties["current_spark"] = value
-                if value == SPARK_DETECTED:
-                    alert = "Spark Detected! Fire Risk!"
-            elif sensor_type == "Smoke":
-                properties["current_smoke"] = value
-                if value > SMOKE_THRESHOLD:
-                    alert = "High Smoke Concentration!"
-
-            # Set alert if triggered, otherwise remove old alerts
-            if alert:
-                properties["alert"] = alert
-            else:
-                properties.pop("alert", None)
-
-            # Update zone properties in DB
-            update_query = """
-                UPDATE zone
-                SET properties = :properties
-                WHERE id = :zone_id
-            """
-            await database.execute(query=update_query, values={"properties": json.dumps(properties), "zone_id": zone_id})
-            print(f"Updated zone '{zone_name}' with {sensor_type} value {value}")
+async def apply_reading(datastream_id, sensor_type, result, value, phenomenon_time, update_zone=True):
+    """Everything that follows the observation insert: latest value, live updates, stats and zone state."""
+    metadata_cache.set_latest(datastream_id, result, phenomenon_time)
+    timestamp = phenomenon_time.timestamp()
+    logger.debug("Inserted %s observation for datastream %s", sensor_type, datastream_id)
 
+    # Now, find the zone that corresponds to this sensor message.
+    zone = await resolve_zone(datastream_id)
+    zone_id, zone_name = zone if zone else (None, None)
+
+    # Push to WebSocket subscribers of this datastream / zone / sensor type (non-blocking)
+    hub.publish(datastream_id, zone_name, sensor_type, result, timestamp)
+
+    if zone:
+        # Feed the in-memory rolling windows served by /Stats (Spark booleans count as 0/1)
+        if isinstance(value, (int, float)):
+            window_stats.record(datastream_id, value, zone_name=zone_name, sensor_type=sensor_type, timestamp=timestamp)
+            anomaly_detector.observe(datastream_id, value, zone_name, sensor_type, timestamp)
+
+        alert_code = None
+        if sensor_type == "Heat":
+            if value > HEAT_THRESHOLD:
+                alert_code = "HIGH_TEMPERATURE"
+        elif sensor_type == "Pression":
+            if value > PRESSION_THRESHOLD:
+                alert_code = "HIGH_PRESSURE"
+        elif sensor_type == "Spark":
+            if value is True:
+                alert_code = "SPARK_DETECTED"
+        elif sensor_type == "Smoke":
+            if value > SMOKE_THRESHOLD:
+                alert_code = "HIGH_SMOKE"
         else:
-            print(f"Warning: No zone found for datastream {datastream_id}")
+            logger.warning("Unknown sensor_type %s", sensor_type)
+            return
 
+        if not update_zone:
+            return
+        # One typed UPSERT: the reading column plus this sensor type's alert slot
+        # (cleared when alert_code is None); other types' alerts are untouched.
+        await record_reading(zone_id, sensor_type, value, alert_code)
+        logger.debug("Updated zone '%s' with %s value %s", zone_name, sensor_type, value)
+    else:
+        if isinstance(value, (int, float)):
+            window_stats.record(datastream_id, value, timestamp=timestamp)
+        logger.warning("No zone found for datastream %s", datastream_id)
+
+async def store_readings(rows):
+    """
+    Insert a batch of (datastream_id, sensor_type, result, value, phenomenon_time)
+    with one statement, then run apply_reading for each row. If the batch is
+    refused (e.g. one unknown datastream), rows are retried one by one so a
+    bad reading only loses itself.
+    """
+    try:
+        await database.execute(query=INSERT_OBSERVATIONS_QUERY, values=_insert_values(rows))
     except Exception as e:
-        print(f"Error processing MQTT message: {e}")
+        if len(rows) == 1:
+            logger.warning("Dropped %s reading for datastream %s: %s", rows[0][1], rows[0][0], e)
+            return
+        stored = []
+        for row in rows:
+            try:
+                await database.execute(query=INSERT_OBSERVATIONS_QUERY, values=_insert_values([row]))
+                stored.append(row)
+            except Exception as row_error:
+                logger.warning("Dropped %s reading for datastream %s: %s", row[1], row[0], row_error)
+        rows = stored
+    # Every reading feeds the stats and live updates; zone_state only needs the newest one per datastream.
+    newest = {}
+    for i, row in enumerate(rows):
+        if row[0] not in newest or row[4] >= rows[newest[row[0]]][4]:
+            newest[row[0]] = i
+    for i, (datastream_id, sensor_type, result, value, phenomenon_time) in enumerate(rows):
+        await apply_reading(datastream_id, sensor_type, result, value, phenomenon_time,
+                            update_zone=newest[datastream_id] == i)
 
-async def mqtt_listener():
-    async with MQTTClient(settings.MQTT_BROKER, settings.MQTT_PORT) as client:
-        await client.subscribe("iot_safeindustech/sensors/#")
-        async for message in client.messages:
-            await process_message(message)
+def _insert_values(rows):
+    return {
+        "obs_ids": [uuid.uuid4() for _ in rows],
+        "ds_ids": [uuid.UUID(row[0]) for row in rows],
+        "phenomenon_times": [row[4] for row in rows],
+        "results": [json.dumps(row[2]) for row in rows],
+    }
 
-def start_mqtt_listener():
-    loop = asyncio.get_event_loop()
-    loop.create_task(mqtt_listener())
-import asyncio
-import json
-import uuid
-from aiomqtt import Client as MQTTClient
-from config import settings
-from db import database
+# ---------------------------------------------------------------------------
+# Sensor families: each topic family has its own decoding, storage and batching
+# ---------------------------------------------------------------------------
 
-# Thresholds for alerts (example values)
-HEAT_THRESHOLD = 70       # °C
-PRESSION_THRESHOLD = 5.0  # bar
-SMOKE_THRESHOLD = 5.0     # ppm
-# For Spark, we assume a True value triggers an alert
+def _numeric(value):
+    return float(value)
 
-async def process_message(message):
-    try:
-        payload_str = message.payload.decode("utf-8")
-        data = json.loads(payload_str)
-        datastream_id = data["datastream_id"]
-        result = data["result"]  # e.g., {"value": 85.0, "unit": "°C"}
-        sensor_type = data.get("sensor_type")  # must be provided: "Heat", "Pression", "Spark", "Smoke"
-
-        if not sensor_type:
-            print("Warning: sensor_type missing in payload")
+def _boolean(value):
+    # Only JSON true/false: "false", 0 or 1 are rejected rather than read as a spark.
+    if value is True or value is False:
+        return value
+    raise ValueError(f"expected a JSON boolean, got {value!r}")
+
+class SensorFamily:
+    """
+    JSON readings of one sensor type ({"datastream_id", "result": {"value", ...}}).
+    The topic names the type, so the payload needs no sensor_type. Readings are
+    buffered and stored with store_readings() once `max_rows` are waiting or
+    `max_delay` seconds after the first one; max_delay 0 stores every reading
+    right away (alarm sensors).
+    """
+
+    def __init__(self, sensor_type, parse_value, max_rows, max_delay):
+        self.sensor_type = sensor_type
+        self.parse_value = parse_value
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.pending = []
+        self.timer = None
+        self.lock = asyncio.Lock()   # one flush at a time keeps readings in order
+        self.tasks = set()
+
+    async def handle(self, topic, payload):
+        try:
+            data = json.loads(payload)
+            datastream_id = str(uuid.UUID(data["datastream_id"]))
+            result = data["result"]
+            value = self.parse_value(result.get("value"))
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning("Rejected %s payload on %s: %s", self.sensor_type, topic, e)
             return
+        self.pending.append((datastream_id, self.sensor_type, result, value, datetime.now(timezone.utc)))
+        if len(self.pending) >= self.max_rows or self.max_delay <= 0:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush_later)
 
-        # Convert the result value as needed (we assume it's numeric or boolean)
-        value = result.get("value")
-        # For numeric sensors, ensure value is a float
-        if sensor_type in ["Heat", "Pression", "Smoke"]:
-            try:
-                value = float(value)
-            except Exception:
-                print(f"Error: Value for {sensor_type} is not numeric: {value}")
+    def _flush_later(self):
+        self.timer = None
+        task = asyncio.create_task(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        async with self.lock:
+            rows, self.pending = self.pending, []
+            if not rows:
                 return
+            try:
+                await store_readings(rows)
+            except Exception as e:
+                logger.error("Error storing %d %s readings: %s", len(rows), self.sensor_type, e, exc_info=True)
 
-        # Insert observation record
-        insert_query = """
-            INSERT INTO observation (id, datastream_id, phenomenon_time, result, created_at)
-            VALUES (:obs_id, :ds_id, NOW(), CAST(:result_text AS jsonb), NOW())
-        """
-        insert_values = {
-            "obs_id": uuid.uuid4(),
-            "ds_id": uuid.UUID(datastream_id),
-            "result_text": json.dumps(result)
-        }
-        await database.execute(query=insert_query, values=insert_values)
-        print(f"Inserted {sensor_type} observation for datastream {datastream_id}")
-
-        # Now, find the zone that corresponds to this sensor message.
-        # The join is based on the common FoI; both the datastream and the zone should share the same feature_of_interest_id.
-        zone_query = """
-            SELECT z.id, z.name, z.properties
-            FROM zone z
-            JOIN datastream d ON d.feature_of_interest_id = z.feature_of_interest_id
-            WHERE d.id = :ds_id
-            LIMIT 1
-        """
-        zone = await database.fetch_one(query=zone_query, values={"ds_id": uuid.UUID(datastream_id)})
-
-        if zone:
-            zone_id = str(zone["id"])
-            zone_name = zone["name"]
-            # Parse current properties; if null, use empty dict
-            properties = json.loads(zone["properties"]) if zone["properties"] else {}
-
-            alert = None
-
-            # Update the zone's properties with the latest value for this sensor type.
-            if sensor_type == "Heat":
-                properties["current_heat"] = value
-                if value > HEAT_THRESHOLD:
-                    alert = "High Temperature Detected!"
-            elif sensor_type == "Pression":
-                properties["current_pression"] = value
-                if value > PRESSION_THRESHOLD:
-                    alert = "Pressure Exceeds Safe Levels!"
-            elif sensor_type == "Spark":
-                properties["current_spark"] = value
-                if value is True:
-                    alert = "Spark Detected! Fire Risk!"
-            elif sensor_type == "Smoke":
-                properties["current_smoke"] = value
-                if value > SMOKE_THRESHOLD:
-                    alert = "High Smoke Concentration!"
-
-            if alert:
-                properties["alert"] = alert
-            else:
-                properties.pop("alert", None)
-
-            update_query = """
-                UPDATE zone
-                SET properties = :properties
-                WHERE id = :zone_id
-            """
-            await database.execute(query=update_query, values={"properties": json.dumps(properties), "zone_id": zone_id})
-            print(f"Updated zone '{zone_name}' with {sensor_type} value {value}")
-        else:
-            print(f"Warning: No zone found for datastream {datastream_id}")
+class PositionFamily:
+    """{"datastream_id", "result": {"lat", "lng"}}: buffered into employee tracks, no observation row."""
 
-    except Exception as e:
-        print(f"Error processing MQTT message: {e}")
+    async def handle(self, topic, payload):
+        try:
+            data = json.loads(payload)
+            datastream_id = data["datastream_id"]
+            result = data["result"]
+            lat, lng = float(result["lat"]), float(result["lng"])
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Rejected position payload on %s: %s", topic, e)
+            return
+        employee_id = position_tracker.employee_for(datastream_id)
+        if not employee_id:
+            logger.warning("No employee for position datastream %s", datastream_id)
+            return
+        position_tracker.record(employee_id, lat, lng)
+        hub.publish(datastream_id, None, "Position", result, time.time())
+
+    async def flush(self):
+        await position_tracker.flush()
+
+class BinaryFamily:
+    """Batches in the binary_payload.py format, any sensor type."""
+
+    async def handle(self, topic, payload):
+        try:
+            readings = decode(bytes(payload))
+        except PayloadError as e:
+            logger.warning("Rejected binary payload on %s: %s", topic, e)
+            return
+        rows = []
+        for handle, kind, value, timestamp in readings:
+            try:
+                # Memory first; handles registered elsewhere since warm-up come from the database
+                datastream_id = await handle_registry.resolve(handle)
+            except Exception as e:
+                logger.error("Error resolving datastream handle %d: %s", handle, e)
+                continue
+            if datastream_id is None:
+                logger.warning("Unknown datastream handle %d", handle)
+                continue
+            if kind == KIND_POSITION:
+                employee_id = position_tracker.employee_for(datastream_id)
+                if employee_id:
+                    position_tracker.record(employee_id, value[0], value[1], timestamp)
+                    hub.publish(datastream_id, None, "Position", result_of(kind, value), timestamp)
+                else:
+                    logger.warning("No employee for position datastream %s", datastream_id)
+                continue
+            phenomenon_time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+            rows.append((datastream_id, SENSOR_TYPES[kind], result_of(kind, value), value, phenomenon_time))
+        if rows:
+            try:
+                await store_readings(rows)
+            except Exception as e:
+                logger.error("Error storing binary batch of %d readings: %s", len(rows), e, exc_info=True)
+
+    async def flush(self):
+        pass
+
+def _sensor_family(sensor_type, parse_value, alarm=False):
+    # Alarm sensors are stored on arrival; the others are batched. A batched
+    # reading only sets or clears its own type's alert slot (zone_state.py), so
+    # storing it later cannot clear a spark or smoke alarm raised meanwhile.
+    if alarm:
+        return SensorFamily(sensor_type, parse_value, max_rows=1, max_delay=0)
+    return SensorFamily(sensor_type, parse_value, settings.INGEST_BATCH_MAX_ROWS, settings.INGEST_BATCH_MAX_DELAY_SECONDS)
+
+# Topic filter -> family. Anything else under the broker is not subscribed to, and
+# rejected without decoding if it arrives anyway.
+FAMILIES = {
+    "iot_safeindustech/sensors/heat": _sensor_family("Heat", _numeric),
+    "iot_safeindustech/sensors/pression": _sensor_family("Pression", _numeric),
+    "iot_safeindustech/sensors/spark": _sensor_family("Spark", _boolean, alarm=True),
+    "iot_safeindustech/sensors/smoke": _sensor_family("Smoke", _numeric, alarm=True),
+    # Per-area temperature probes (iot_safeindustech/sensors/temperature/<area>) are heat readings.
+    "iot_safeindustech/sensors/temperature/+": _sensor_family("Heat", _numeric),
+    "iot_safeindustech/sensors/position": PositionFamily(),
+    BINARY_TOPIC: BinaryFamily(),
+}
+
+topic_registry = TopicRegistry()
+for _pattern, _family in FAMILIES.items():
+    topic_registry.register(_pattern, _family)
+
+async def flush_families():
+    """Store everything still buffered (shutdown)."""
+    for family in FAMILIES.values():
+        await family.flush()
+
+async def listen_once():
+    try:
+        # MQTT 5 so that message properties (the binary ContentType below) reach us
+        async with MQTTClient(settings.MQTT_BROKER, settings.MQTT_PORT,
+                              protocol=ProtocolVersion(settings.MQTT_PROTOCOL_VERSION)) as client:
+            # Only the topics that have a handler
+            for pattern in topic_registry.patterns():
+                await client.subscribe(pattern)
+            mqtt_state.update(subscribed=True, subscribed_at=time.time())
+            logger.info("Subscribed to %s on %s:%s", ", ".join(topic_registry.patterns()),
+                        settings.MQTT_BROKER, settings.MQTT_PORT)
+            async for message in client.messages:
+                properties = getattr(message, "properties", None)
+                if getattr(properties, "ContentType", None) == CONTENT_TYPE:
+                    # MQTT 5 content type marks a binary batch on any topic
+                    await FAMILIES[BINARY_TOPIC].handle(str(message.topic), message.payload)
+                    continue
+                await topic_registry.dispatch(str(message.topic), message.payload)
+    finally:
+        mqtt_state["subscribed"] = False
 
 async def mqtt_listener():
-    async with MQTTClient(settings.MQTT_BROKER, settings.MQTT_PORT) as client:
-        await client.subscribe("iot_safeindustech/sensors/#")
-        async for message in client.messages:
-            # Convert the topic to a string (in case it's not)
-            topic = str(message.topic)
-            # Dispatch based on sensor type if you use separate topics,
-            # or let the payload's sensor_type field handle it.
-            await process_message(message)
+    """Keep the subscription up: reconnect with exponential backoff whenever the connection fails or ends."""
+    delay = settings.MQTT_RECONNECT_INITIAL_SECONDS
+    while True:
+        attempt_started = time.time()
+        try:
+            await listen_once()
+            mqtt_state["last_error"] = "connection closed"
+        except Exception as e:
+            mqtt_state["last_error"] = str(e)
+        if (mqtt_state["subscribed_at"] or 0) >= attempt_started:
+            # This attempt got subscribed: a new outage starts again from the initial pause.
+            delay = settings.MQTT_RECONNECT_INITIAL_SECONDS
+        mqtt_state["reconnects"] += 1
+        logger.error("MQTT connection lost (%s), reconnecting in %s s", mqtt_state["last_error"], delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, settings.MQTT_RECONNECT_MAX_SECONDS)
+
+def _listener_done(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("MQTT listener stopped", exc_info=task.exception())
 
 def start_mqtt_listener():
     loop = asyncio.get_event_loop()
-    loop.create_task(mqtt_listener())
+    task = loop.create_task(mqtt_listener())
+    task.add_done_callback(_listener_done)
+    return task
@@ -1,28 +1,117 @@
 # observations_router.py
-from fastapi import APIRouter, Query
-from db import database
+import csv
+import io
 import json
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from db import database
+from config import settings
+from archive import read_archive, ARCHIVE_COLUMNS
+from query_options import QueryOptions, query_options, compile_query, decode_row
 
 observations_router = APIRouter(prefix="/Observations", tags=["Observations"])
 
+# Column -> SQL expression for history reads from the hot table (mirrors the archive columns).
+HISTORY_COLUMNS = {
+    "id": "id",
+    "phenomenon_time": "phenomenon_time",
+    "value": """CASE jsonb_typeof(CAST(result AS jsonb)->'value')
+                    WHEN 'number' THEN CAST(result->>'value' AS double precision)
+                    WHEN 'boolean' THEN CASE WHEN CAST(result->>'value' AS boolean) THEN 1.0 ELSE 0.0 END
+                END""",
+    "result": "result",
+    "created_at": "created_at",
+}
+
+def history_query(columns):
+    return f"""
+        SELECT {", ".join(f'{HISTORY_COLUMNS[c]} AS "{c}"' for c in columns)}
+        FROM observation
+        WHERE datastream_id = :datastream_id AND phenomenon_time >= :start AND phenomenon_time < :end
+        ORDER BY phenomenon_time
+        LIMIT :limit
+    """
+
 @observations_router.get("/")
-async def get_observations(datastream_id: str = Query(None), limit: int = 10):
-    base_query = "SELECT * FROM observation"
-    if datastream_id:
-        base_query += " WHERE datastream_id = :datastream_id"
-    base_query += " ORDER BY phenomenon_time DESC LIMIT :limit"
-    values = {"limit": limit}
-    if datastream_id:
-        values["datastream_id"] = datastream_id
-
-    rows = await database.fetch_all(query=base_query, values=values)
-    observations = []
-    for row in rows:
-        observations.append({
-            "id": row["id"],
-            "datastream_id": row["datastream_id"],
-            "result": json.loads(row["result"]),
-            "phenomenon_time": row["phenomenon_time"].isoformat(),
-            "created_at": row["created_at"].isoformat()
-        })
-    return observations
+async def get_observations(
+    datastream_id: str = Query(None),
+    limit: int = 10,
+    options: QueryOptions = Depends(query_options),
+):
+    """
+    SensorThings collection over the hot table only: $filter/$orderby compile to
+    one SQL query, which the Parquet archive cannot take part in. Observations
+    older than ARCHIVE_AFTER_DAYS are read through /Observations/history.
+    """
+    # `datastream_id` and `limit` predate the SensorThings options and are kept for existing clients.
+    where = {"datastream_id": datastream_id} if datastream_id else None
+    if options.top is None:
+        options.top = limit
+
+    query, values = compile_query("Observation", options, where=where)
+    rows = await database.fetch_all(query=query, values=values)
+    return [decode_row("Observation", options, row) for row in rows]
+
+@observations_router.get("/history")
+async def get_observation_history(
+    datastream_id: str,
+    start: datetime,
+    end: Optional[datetime] = None,
+    select: Optional[str] = Query(None, alias="$select"),
+    limit: Optional[int] = Query(None, ge=1),
+    format: str = Query("json", pattern="^(json|csv)$"),
+):
+    """
+    Observations of one datastream in [start, end), oldest first. Days moved to
+    the Parquet archive (see archive.py) are read from there transparently; the
+    hot table is always queried too, so late rows for archived days are included.
+    """
+    try:
+        # Also part of the archive path, so it must be a real UUID
+        datastream_id = uuid.UUID(datastream_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="datastream_id must be a UUID")
+    start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    end = end or datetime.now(timezone.utc)
+    end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    columns = [c.strip() for c in select.split(",")] if select else list(ARCHIVE_COLUMNS)
+    unknown = [c for c in columns if c not in HISTORY_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown history columns: {', '.join(unknown)}")
+    # phenomenon_time is always needed to merge both tiers in order, id to drop
+    # rows present in both (archived, not yet deleted from the table).
+    read_columns = columns + [c for c in ("phenomenon_time", "id") if c not in columns]
+    limit = min(limit or settings.QUERY_MAX_TOP, settings.QUERY_MAX_TOP)
+
+    # Both tiers return at most `limit` rows, oldest first.
+    archived = await read_archive(datastream_id, start, end, read_columns, limit=limit)
+    rows = await database.fetch_all(query=history_query(read_columns), values={
+        "datastream_id": datastream_id, "start": start, "end": end, "limit": limit,
+    })
+    archived_ids = {item["id"] for item in archived}
+    hot = [dict(row) for row in rows if str(row["id"]) not in archived_ids]
+    merged = sorted(archived + hot, key=lambda item: item["phenomenon_time"])[:limit]
+    for item in merged:
+        if "result" in item and isinstance(item["result"], str):
+            item["result"] = json.loads(item["result"])
+        for column in read_columns[len(columns):]:
+            del item[column]
+
+    if format == "csv":
+        def lines():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columns)
+            writer.writeheader()
+            for item in merged:
+                writer.writerow({k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in item.items()})
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        return StreamingResponse(lines(), media_type="text/csv")
+    return merged
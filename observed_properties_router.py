@@ -1,15 +1,18 @@
 # observed_properties_router.py
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from db import database
+from query_options import QueryOptions, query_options, compile_query, decode_row
 
 observed_properties_router = APIRouter(prefix="/ObservedProperties", tags=["ObservedProperties"])
 
 @observed_properties_router.get("/")
-async def get_observed_properties():
-    query = "SELECT * FROM observed_property"
-    return await database.fetch_all(query=query)
+async def get_observed_properties(options: QueryOptions = Depends(query_options)):
+    query, values = compile_query("ObservedProperty", options)
+    rows = await database.fetch_all(query=query, values=values)
+    return [decode_row("ObservedProperty", options, row) for row in rows]
 
 @observed_properties_router.get("/{observed_property_id}")
-async def get_observed_property(observed_property_id: str):
-    query = "SELECT * FROM observed_property WHERE id = :observed_property_id"
-    return await database.fetch_one(query=query, values={"observed_property_id": observed_property_id})
+async def get_observed_property(observed_property_id: str, options: QueryOptions = Depends(query_options)):
+    query, values = compile_query("ObservedProperty", options, where={"id": observed_property_id})
+    row = await database.fetch_one(query=query, values=values)
+    return decode_row("ObservedProperty", options, row) if row else None
@@ -0,0 +1,159 @@
+-- perf/schema.sql
+-- Tables of the iot_safeindustech database, reconstructed for perf_regression.py.
+-- backup.sql is a data-only custom-format dump (pg_restore -l lists TABLE DATA
+-- entries only), so the regression database is created from this file first and
+-- the dump is then restored with pg_restore --data-only. Column order follows
+-- the COPY column lists in the dump.
+--
+-- Foreign keys are left out: pg_restore loads the tables in dump order, and the
+-- queries under test do not depend on them. The dump carries no index
+-- definitions, so only the primary keys are created here; indexes the
+-- application needs belong in its startup schema (like zone_state.py), which
+-- perf_regression.py applies after the restore. The plans compared against
+-- perf/baseline.json depend on that.
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+CREATE TABLE usine (
+    id          uuid PRIMARY KEY,
+    name        text NOT NULL,
+    description text,
+    area        geometry(Polygon, 4326),
+    properties  jsonb,
+    created_at  timestamp DEFAULT now()
+);
+
+CREATE TABLE feature_of_interest (
+    id          uuid PRIMARY KEY,
+    name        text NOT NULL,
+    description text,
+    feature     geometry(Geometry, 4326),
+    properties  jsonb,
+    created_at  timestamp DEFAULT now()
+);
+
+CREATE TABLE usine_feature_of_interest (
+    id                     uuid PRIMARY KEY,
+    usine_id               uuid,
+    feature_of_interest_id uuid
+);
+
+CREATE TABLE zone (
+    id                     uuid PRIMARY KEY,
+    usine_id               uuid,
+    name                   text NOT NULL,
+    area                   geometry(Polygon, 4326),
+    risk_level             text,
+    properties             jsonb,
+    created_at             timestamp DEFAULT now(),
+    feature_of_interest_id uuid
+);
+
+CREATE TABLE equipment (
+    id               uuid PRIMARY KEY,
+    zone_id          uuid,
+    type             text,
+    status           text,
+    last_maintenance timestamp,
+    location         geometry(Point, 4326),
+    properties       jsonb,
+    created_at       timestamp DEFAULT now()
+);
+
+CREATE TABLE wifi_access_point (
+    id          uuid PRIMARY KEY,
+    zone_id     uuid,
+    ssid        text,
+    mac_address text,
+    location    geometry(Point, 4326),
+    properties  jsonb,
+    created_at  timestamp DEFAULT now()
+);
+
+CREATE TABLE thing (
+    id          uuid PRIMARY KEY,
+    name        text NOT NULL,
+    description text,
+    properties  jsonb,
+    created_at  timestamp DEFAULT now()
+);
+
+CREATE TABLE location (
+    id           uuid PRIMARY KEY,
+    thing_id     uuid,
+    name         text,
+    location     geometry(Geometry, 4326),
+    properties   jsonb,
+    created_at   timestamp DEFAULT now(),
+    description  text,
+    encodingtype text
+);
+
+CREATE TABLE historical_location (
+    id          uuid PRIMARY KEY,
+    thing_id    uuid,
+    location_id uuid,
+    "time"      timestamptz,
+    created_at  timestamp DEFAULT now()
+);
+
+CREATE TABLE sensor (
+    id            uuid PRIMARY KEY,
+    thing_id      uuid,
+    name          text NOT NULL,
+    description   text,
+    encoding_type text,
+    metadata      jsonb,
+    created_at    timestamp DEFAULT now()
+);
+
+CREATE TABLE observed_property (
+    id          uuid PRIMARY KEY,
+    name        text NOT NULL,
+    definition  text,
+    description text,
+    properties  jsonb,
+    created_at  timestamp DEFAULT now()
+);
+
+CREATE TABLE datastream (
+    id                     uuid PRIMARY KEY,
+    thing_id               uuid,
+    sensor_id              uuid,
+    observed_property_id   uuid,
+    name                   text NOT NULL,
+    description            text,
+    unit_of_measurement    jsonb,
+    observed_area          geometry(Polygon, 4326),
+    phenomenon_time        tstzrange,
+    result_time            tstzrange,
+    properties             jsonb,
+    created_at             timestamp DEFAULT now(),
+    observation_type       text,
+    feature_of_interest_id uuid
+);
+
+CREATE TABLE observation (
+    id                     uuid PRIMARY KEY,
+    datastream_id          uuid NOT NULL,
+    phenomenon_time        timestamptz NOT NULL,
+    result                 jsonb,
+    valid_time             tstzrange,
+    parameters             jsonb,
+    created_at             timestamp DEFAULT now(),
+    feature_of_interest_id uuid
+);
+
+CREATE TABLE employee_position (
+    id   uuid PRIMARY KEY,
+    name text NOT NULL
+);
+
+CREATE TABLE employee (
+    id          uuid PRIMARY KEY,
+    name        text NOT NULL,
+    position_id uuid,
+    phone_id    text,
+    usine_id    uuid,
+    created_at  timestamp DEFAULT now()
+);
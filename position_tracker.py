@@ -0,0 +1,284 @@
+# position_tracker.py
+"""
+Employee position tracking.
+
+  - employee_datastream: explicit employee -> position datastream mapping
+    (backfilled once from the 'Employee Tracker - <name>' thing convention).
+  - employee_track: one row per employee per hour with packed arrays
+    (millisecond offsets from the bucket start, latitudes, longitudes)
+    instead of one jsonb observation row per sample.
+  - employee_track_chunk: staging for the hours still open, one small row
+    per employee, bucket and flush.
+
+Ingest appends samples to an in-memory buffer; a background task flushes it
+with one INSERT per employee and bucket into employee_track_chunk, so a flush
+never rewrites the (TOASTed) arrays already stored. Once an hour has been
+closed for TRACK_COMPACT_DELAY_SECONDS, its chunks are merged into a single
+employee_track row, sorted by time, and deleted, in one statement. Reading a
+track is an index range scan over both tables, and trajectories are
+simplified server-side with Douglas-Peucker before they are returned.
+"""
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from config import settings
+from db import database
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS employee_datastream (
+        employee_id   uuid PRIMARY KEY REFERENCES employee(id) ON DELETE CASCADE,
+        datastream_id uuid NOT NULL UNIQUE REFERENCES datastream(id) ON DELETE CASCADE
+    )
+    """,
+    """
+    INSERT INTO employee_datastream (employee_id, datastream_id)
+    SELECT DISTINCT ON (e.id) e.id, d.id
+    FROM employee e
+    JOIN thing t ON t.name = 'Employee Tracker - ' || e.name
+    JOIN datastream d ON d.thing_id = t.id
+    ORDER BY e.id, d.created_at
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS employee_track (
+        employee_id  uuid NOT NULL REFERENCES employee(id) ON DELETE CASCADE,
+        bucket_start timestamptz NOT NULL,
+        offsets_ms   integer[] NOT NULL,
+        lats         double precision[] NOT NULL,
+        lngs         double precision[] NOT NULL,
+        PRIMARY KEY (employee_id, bucket_start)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS employee_track_chunk (
+        id           bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        employee_id  uuid NOT NULL REFERENCES employee(id) ON DELETE CASCADE,
+        bucket_start timestamptz NOT NULL,
+        offsets_ms   integer[] NOT NULL,
+        lats         double precision[] NOT NULL,
+        lngs         double precision[] NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS employee_track_chunk_employee ON employee_track_chunk (employee_id, bucket_start)",
+    # One-time import of the position observations stored before employee_track existed.
+    """
+    INSERT INTO employee_track (employee_id, bucket_start, offsets_ms, lats, lngs)
+    SELECT
+        ed.employee_id,
+        date_trunc('hour', o.phenomenon_time) AS bucket_start,
+        array_agg(CAST(EXTRACT(EPOCH FROM o.phenomenon_time - date_trunc('hour', o.phenomenon_time)) * 1000 AS integer)
+                  ORDER BY o.phenomenon_time),
+        array_agg(CAST(o.result->>'lat' AS double precision) ORDER BY o.phenomenon_time),
+        array_agg(CAST(o.result->>'lng' AS double precision) ORDER BY o.phenomenon_time)
+    FROM observation o
+    JOIN employee_datastream ed ON ed.datastream_id = o.datastream_id
+    WHERE o.result->>'lat' IS NOT NULL AND o.result->>'lng' IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM employee_track)
+    GROUP BY ed.employee_id, date_trunc('hour', o.phenomenon_time)
+    ON CONFLICT DO NOTHING
+    """,
+]
+
+APPEND_QUERY = """
+    INSERT INTO employee_track_chunk (employee_id, bucket_start, offsets_ms, lats, lngs)
+    VALUES (:employee_id, :bucket_start, :offsets_ms, :lats, :lngs)
+"""
+
+# Chunks of closed hours -> one time-sorted row per employee and hour. Samples that
+# arrive after their hour was compacted are appended to it by a later run.
+COMPACT_QUERY = """
+    WITH moved AS (
+        DELETE FROM employee_track_chunk
+        WHERE bucket_start < :before
+        RETURNING id, employee_id, bucket_start, offsets_ms, lats, lngs
+    ), packed AS (
+        SELECT m.employee_id, m.bucket_start,
+               array_agg(s.offset_ms ORDER BY s.offset_ms, m.id, s.n) AS offsets_ms,
+               array_agg(s.lat ORDER BY s.offset_ms, m.id, s.n) AS lats,
+               array_agg(s.lng ORDER BY s.offset_ms, m.id, s.n) AS lngs
+        FROM moved m, unnest(m.offsets_ms, m.lats, m.lngs) WITH ORDINALITY AS s(offset_ms, lat, lng, n)
+        GROUP BY m.employee_id, m.bucket_start
+    )
+    INSERT INTO employee_track (employee_id, bucket_start, offsets_ms, lats, lngs)
+    SELECT employee_id, bucket_start, offsets_ms, lats, lngs FROM packed
+    ON CONFLICT (employee_id, bucket_start) DO UPDATE SET
+        offsets_ms = employee_track.offsets_ms || EXCLUDED.offsets_ms,
+        lats = employee_track.lats || EXCLUDED.lats,
+        lngs = employee_track.lngs || EXCLUDED.lngs
+"""
+
+TRACK_QUERY = """
+    SELECT bucket_start, offsets_ms, lats, lngs
+    FROM employee_track
+    WHERE employee_id = :employee_id
+      AND bucket_start >= :first_bucket AND bucket_start < :end
+    UNION ALL
+    SELECT bucket_start, offsets_ms, lats, lngs
+    FROM employee_track_chunk
+    WHERE employee_id = :employee_id
+      AND bucket_start >= :first_bucket AND bucket_start < :end
+    ORDER BY bucket_start
+"""
+
+# Last sample of the newest compacted row or chunk of each employee.
+LATEST_POSITIONS_QUERY = """
+    SELECT e.id AS employee_id, e.name, t.bucket_start, t.offset_ms, t.lat, t.lng
+    FROM employee e
+    JOIN employee_datastream ed ON ed.employee_id = e.id
+    LEFT JOIN LATERAL (
+        SELECT bucket_start,
+               offsets_ms[array_length(offsets_ms, 1)] AS offset_ms,
+               lats[array_length(lats, 1)] AS lat,
+               lngs[array_length(lngs, 1)] AS lng
+        FROM (
+            (SELECT bucket_start, offsets_ms, lats, lngs
+             FROM employee_track
+             WHERE employee_id = e.id
+             ORDER BY bucket_start DESC
+             LIMIT 1)
+            UNION ALL
+            (SELECT bucket_start, offsets_ms, lats, lngs
+             FROM employee_track_chunk
+             WHERE employee_id = e.id
+             ORDER BY bucket_start DESC, id DESC
+             LIMIT 1)
+        ) newest
+        ORDER BY bucket_start DESC, offset_ms DESC
+        LIMIT 1
+    ) t ON true
+    ORDER BY e.name
+"""
+
+
+def _bucket_start(ts):
+    moment = datetime.fromtimestamp(ts, tz=timezone.utc)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class PositionTracker:
+    def __init__(self):
+        self.employee_by_datastream = {}   # datastream id -> employee id
+        self.pending = {}                  # (employee id, bucket start) -> ([offset_ms], [lat], [lng])
+        self.latest = {}                   # employee id -> (lat, lng, timestamp)
+
+    async def load(self):
+        rows = await database.fetch_all(query="SELECT employee_id, datastream_id FROM employee_datastream")
+        self.employee_by_datastream = {str(row["datastream_id"]): str(row["employee_id"]) for row in rows}
+
+    def employee_for(self, datastream_id):
+        return self.employee_by_datastream.get(str(datastream_id))
+
+    def record(self, employee_id, lat, lng, ts=None):
+        ts = ts or time.time()
+        bucket = _bucket_start(ts)
+        offsets, lats, lngs = self.pending.setdefault((employee_id, bucket), ([], [], []))
+        offsets.append(int((ts - bucket.timestamp()) * 1000))
+        lats.append(float(lat))
+        lngs.append(float(lng))
+        self.latest[employee_id] = (float(lat), float(lng), datetime.fromtimestamp(ts, tz=timezone.utc))
+
+    async def flush(self):
+        buckets = list(self.pending.items())
+        self.pending = {}
+        for i, ((employee_id, bucket), (offsets, lats, lngs)) in enumerate(buckets):
+            try:
+                await database.execute(query=APPEND_QUERY, values={
+                    "employee_id": employee_id, "bucket_start": bucket,
+                    "offsets_ms": offsets, "lats": lats, "lngs": lngs,
+                })
+            except Exception:
+                # Keep this bucket and the ones not written yet for the next flush
+                self._restore(buckets[i:])
+                raise
+        await self.compact()
+
+    async def compact(self):
+        """Merge the chunks of hours closed for TRACK_COMPACT_DELAY_SECONDS into employee_track."""
+        before = time.time() - 3600 - settings.TRACK_COMPACT_DELAY_SECONDS
+        await database.execute(query=COMPACT_QUERY, values={
+            "before": datetime.fromtimestamp(before, tz=timezone.utc),
+        })
+
+    def _restore(self, buckets):
+        """Put unwritten buckets back, ahead of samples recorded since the flush started."""
+        for key, (offsets, lats, lngs) in buckets:
+            newer = self.pending.get(key)
+            if newer:
+                offsets.extend(newer[0])
+                lats.extend(newer[1])
+                lngs.extend(newer[2])
+            self.pending[key] = (offsets, lats, lngs)
+
+    async def track(self, employee_id, start, end):
+        """(timestamps as epoch seconds, lats, lngs) between start and end, oldest first."""
+        rows = await database.fetch_all(query=TRACK_QUERY, values={
+            "employee_id": employee_id,
+            "first_bucket": start.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0),
+            "end": end,
+        })
+        times, lats, lngs = [], [], []
+        for row in rows:
+            base = row["bucket_start"].timestamp()
+            times.append(base + np.asarray(row["offsets_ms"], dtype=np.float64) / 1000.0)
+            lats.append(np.asarray(row["lats"], dtype=np.float64))
+            lngs.append(np.asarray(row["lngs"], dtype=np.float64))
+        # Samples not flushed yet
+        for (pending_employee, bucket), (offsets, p_lats, p_lngs) in self.pending.items():
+            if pending_employee == employee_id:
+                times.append(bucket.timestamp() + np.asarray(offsets, dtype=np.float64) / 1000.0)
+                lats.append(np.asarray(p_lats, dtype=np.float64))
+                lngs.append(np.asarray(p_lngs, dtype=np.float64))
+        if not times:
+            empty = np.empty(0)
+            return empty, empty, empty
+        t, la, ln = np.concatenate(times), np.concatenate(lats), np.concatenate(lngs)
+        order = np.argsort(t, kind="stable")
+        t, la, ln = t[order], la[order], ln[order]
+        mask = (t >= start.timestamp()) & (t < end.timestamp())
+        return t[mask], la[mask], ln[mask]
+
+
+def simplify(lats, lngs, tolerance_m):
+    """
+    Douglas-Peucker over an equirectangular projection in metres.
+    Returns the indices of the points to keep (always first and last).
+    """
+    n = lats.size
+    if n < 3 or tolerance_m <= 0:
+        return np.arange(n)
+    lat0 = np.radians(lats.mean())
+    x = (lngs - lngs[0]) * 111_320.0 * np.cos(lat0)
+    y = (lats - lats[0]) * 110_540.0
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance_m:
+            middle = a + 1 + i
+            keep[middle] = True
+            stack.append((a, middle))
+            stack.append((middle, b))
+    return np.flatnonzero(keep)
+
+
+position_tracker = PositionTracker()
+
+
+async def ensure_schema():
+    for statement in SCHEMA:
+        await database.execute(query=statement)
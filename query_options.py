@@ -0,0 +1,586 @@
+# query_options.py
+"""
+OGC SensorThings-style query options for the catalog routers.
+
+`$select`, `$filter`, `$orderby`, `$top`, `$skip` and `$expand` are parsed
+into a QueryOptions tree and compiled into ONE parameterized SQL statement:
+only the requested columns are selected, filters and ordering run in
+Postgres, and expansions are correlated sub-selects aggregated with
+json_agg, so an expanded response never costs extra round trips.
+
+Examples:
+    /Sensors/?$select=id,name&$filter=contains(name,'Heat')
+    /Sensors/?$expand=Datastreams($select=id,name;$expand=Observations($top=1))
+    /Observations/?$filter=result gt 70 and phenomenon_time ge 2025-01-01T00:00:00Z
+
+Literals must fit the property they are compared with (text and JSON
+documents with strings, ids with UUID strings, times with datetimes), anything
+else is a 400. `created_at` columns are `timestamp without time zone` holding
+UTC; datetimes compared with them are converted to naive UTC.
+
+Time-interval properties (tstzrange: Datastream phenomenon_time/result_time,
+Observation valid_time) compare with a datetime t as: eq -> the interval
+contains t, gt/lt -> the whole interval is after/before t, ge/le -> it starts
+at or after / ends at or before t. They are returned in their text form,
+e.g. '["2025-01-01 00:00:00+00","2025-01-02 00:00:00+00")'.
+"""
+import json
+import re
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import HTTPException, Query
+from config import settings
+
+
+# ---------------------------------------------------------------------------
+# Entity model (table, columns and navigation links exposed to clients)
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Link:
+    target: str       # entity name of the other side
+    many: bool        # True -> JSON array, False -> JSON object (or null)
+    child_key: str    # column on the target table ...
+    parent_key: str   # ... equal to this column on the parent table
+
+
+@dataclass
+class Entity:
+    table: str
+    columns: dict                     # column name -> kind (uuid/text/json/time/timestamp/range/geometry)
+    default_select: list
+    links: dict = field(default_factory=dict)
+    default_orderby: Optional[str] = None
+
+
+ENTITIES = {
+    "Sensor": Entity(
+        table="sensor",
+        columns={
+            "id": "uuid", "thing_id": "uuid", "name": "text", "description": "text",
+            "encoding_type": "text", "metadata": "json", "created_at": "timestamp",
+        },
+        default_select=["id", "thing_id", "name", "description", "encoding_type", "metadata", "created_at"],
+        links={"Datastreams": Link("Datastream", True, "sensor_id", "id")},
+    ),
+    "ObservedProperty": Entity(
+        table="observed_property",
+        columns={
+            "id": "uuid", "name": "text", "definition": "text", "description": "text",
+            "properties": "json", "created_at": "timestamp",
+        },
+        default_select=["id", "name", "definition", "description", "properties", "created_at"],
+        links={"Datastreams": Link("Datastream", True, "observed_property_id", "id")},
+    ),
+    "Datastream": Entity(
+        table="datastream",
+        columns={
+            "id": "uuid", "thing_id": "uuid", "sensor_id": "uuid", "observed_property_id": "uuid",
+            "name": "text", "description": "text", "unit_of_measurement": "json",
+            "observed_area": "geometry", "phenomenon_time": "range", "result_time": "range",
+            "properties": "json", "created_at": "timestamp", "observation_type": "text",
+            "feature_of_interest_id": "uuid",
+        },
+        default_select=[
+            "id", "thing_id", "sensor_id", "observed_property_id", "name", "description",
+            "unit_of_measurement", "observation_type", "feature_of_interest_id",
+        ],
+        links={
+            "Observations": Link("Observation", True, "datastream_id", "id"),
+            "Sensor": Link("Sensor", False, "id", "sensor_id"),
+            "ObservedProperty": Link("ObservedProperty", False, "id", "observed_property_id"),
+        },
+    ),
+    "Observation": Entity(
+        table="observation",
+        columns={
+            "id": "uuid", "datastream_id": "uuid", "phenomenon_time": "time", "result": "json",
+            "valid_time": "range", "parameters": "json", "created_at": "timestamp",
+            "feature_of_interest_id": "uuid",
+        },
+        # Same shape the /Observations/ endpoint has always returned.
+        default_select=["id", "datastream_id", "result", "phenomenon_time", "created_at"],
+        links={"Datastream": Link("Datastream", False, "id", "datastream_id")},
+        default_orderby="phenomenon_time desc",
+    ),
+}
+
+# `result` is stored as {"value": ..., "unit": ...}; STA filters address the value.
+PROPERTY_ALIASES = {("Observation", "result"): "result/value"}
+
+
+# ---------------------------------------------------------------------------
+# Parsing of the raw query string options
+# ---------------------------------------------------------------------------
+
+@dataclass
+class QueryOptions:
+    select: Optional[list] = None
+    filter: Optional[str] = None
+    orderby: Optional[str] = None
+    top: Optional[int] = None
+    skip: int = 0
+    expand: dict = field(default_factory=dict)   # navigation name -> QueryOptions
+
+
+def _split_top_level(text, sep):
+    """Split on `sep` outside of parentheses and quoted strings."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _parse_int(name, raw):
+    try:
+        value = int(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an integer")
+    if value < 0:
+        raise HTTPException(status_code=400, detail=f"{name} must be >= 0")
+    return value
+
+
+def _parse_expand(text):
+    expand = {}
+    for item in _split_top_level(text, ","):
+        # `Datastreams/Observations` is shorthand for nested expansion.
+        match = re.fullmatch(r"([A-Za-z_]+)(?:/(.+?))?(?:\((.*)\))?", item, re.S)
+        if not match:
+            raise HTTPException(status_code=400, detail=f"Invalid $expand item: {item}")
+        name, nested_path, inner = match.groups()
+        options = expand.setdefault(name, QueryOptions())
+        if nested_path:
+            inner = f"$expand={nested_path}" + (f"({inner})" if inner else "")
+        if inner:
+            _apply_options(options, _split_top_level(inner, ";"))
+    return expand
+
+
+def _apply_options(options, items):
+    for item in items:
+        key, _, value = item.partition("=")
+        key, value = key.strip(), value.strip()
+        if key == "$select":
+            options.select = [c.strip() for c in value.split(",") if c.strip()]
+        elif key == "$filter":
+            options.filter = value
+        elif key == "$orderby":
+            options.orderby = value
+        elif key == "$top":
+            options.top = _parse_int("$top", value)
+        elif key == "$skip":
+            options.skip = _parse_int("$skip", value)
+        elif key == "$expand":
+            for name, nested in _parse_expand(value).items():
+                options.expand[name] = nested
+        else:
+            raise HTTPException(status_code=400, detail=f"Unsupported query option: {key}")
+
+
+def query_options(
+    select: Optional[str] = Query(None, alias="$select"),
+    filter: Optional[str] = Query(None, alias="$filter"),
+    orderby: Optional[str] = Query(None, alias="$orderby"),
+    top: Optional[int] = Query(None, alias="$top", ge=0),
+    skip: int = Query(0, alias="$skip", ge=0),
+    expand: Optional[str] = Query(None, alias="$expand"),
+) -> QueryOptions:
+    """FastAPI dependency collecting the `$`-prefixed query options."""
+    options = QueryOptions(filter=filter, orderby=orderby, top=top, skip=skip)
+    if select:
+        options.select = [c.strip() for c in select.split(",") if c.strip()]
+    if expand:
+        options.expand = _parse_expand(expand)
+    return options
+
+
+# ---------------------------------------------------------------------------
+# $filter expression parser
+# ---------------------------------------------------------------------------
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<datetime>\d{4}-\d{2}-\d{2}T[0-9:.]+(?:Z|[+-]\d{2}:\d{2})?)
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+      | (?P<punct>[(),])
+      | (?P<word>[A-Za-z_][A-Za-z0-9_/]*)
+    )""", re.X)
+
+COMPARISONS = {"eq": "=", "ne": "<>", "gt": ">", "ge": ">=", "lt": "<", "le": "<="}
+# Kinds that can be compared with each other property to property
+COMPARABLE_KINDS = {"time": "time", "timestamp": "time", "uuid": "uuid", "text": "text"}
+# Comparison -> range operator against the instant [t, t] (see the module docstring)
+RANGE_COMPARISONS = {">": ">>", ">=": "&>", "<": "<<", "<=": "&<"}
+STRING_FUNCTIONS = {"contains", "startswith", "endswith"}
+
+
+def _tokenize(text):
+    tokens, pos = [], 0
+    text = text.strip()
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match or match.end() == pos:
+            raise HTTPException(status_code=400, detail=f"Invalid $filter near: {text[pos:pos + 20]}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+    return tokens
+
+
+def _parse_datetime(raw):
+    try:
+        return datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid datetime in $filter: {raw}")
+
+
+def _naive_utc(value):
+    """`timestamp` columns hold UTC without a zone; naive literals are taken as UTC already."""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+
+class _FilterParser:
+    """Recursive-descent parser turning a $filter string into a SQL fragment."""
+
+    def __init__(self, compiler, entity_name, alias, text):
+        self.compiler = compiler
+        self.entity_name = entity_name
+        self.alias = alias
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        sql = self._or()
+        if self.pos != len(self.tokens):
+            raise HTTPException(status_code=400, detail=f"Unexpected token in $filter: {self.tokens[self.pos][1]}")
+        return sql
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise HTTPException(status_code=400, detail="Unexpected end of $filter")
+        self.pos += 1
+        return token
+
+    def _expect(self, value):
+        kind, text = self._next()
+        if text != value:
+            raise HTTPException(status_code=400, detail=f"Expected '{value}' in $filter, got '{text}'")
+
+    def _keyword(self, word):
+        kind, text = self._peek()
+        if kind == "word" and text.lower() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def _or(self):
+        parts = [self._and()]
+        while self._keyword("or"):
+            parts.append(self._and())
+        return parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")"
+
+    def _and(self):
+        parts = [self._unary()]
+        while self._keyword("and"):
+            parts.append(self._unary())
+        return parts[0] if len(parts) == 1 else "(" + " AND ".join(parts) + ")"
+
+    def _unary(self):
+        if self._keyword("not"):
+            return f"NOT ({self._unary()})"
+        kind, text = self._peek()
+        if kind == "punct" and text == "(":
+            self.pos += 1
+            sql = self._or()
+            self._expect(")")
+            return sql
+        if kind == "word" and text.lower() in STRING_FUNCTIONS:
+            return self._string_function()
+        return self._comparison()
+
+    def _operand(self):
+        kind, text = self._next()
+        if kind == "string":
+            return ("literal", text[1:-1].replace("''", "'"))
+        if kind == "number":
+            return ("literal", float(text) if any(c in text for c in ".eE") else int(text))
+        if kind == "datetime":
+            return ("literal", _parse_datetime(text))
+        if kind == "word":
+            lowered = text.lower()
+            if lowered in ("true", "false"):
+                return ("literal", lowered == "true")
+            if lowered == "null":
+                return ("literal", None)
+            return ("property", text)
+        raise HTTPException(status_code=400, detail=f"Unexpected token in $filter: {text}")
+
+    def _comparison(self):
+        left = self._operand()
+        kind, op = self._next()
+        if kind != "word" or op.lower() not in COMPARISONS:
+            raise HTTPException(status_code=400, detail=f"Unknown comparison operator: {op}")
+        op = COMPARISONS[op.lower()]
+        right = self._operand()
+        if left[0] == "literal" and right[0] == "property":
+            # `70 lt result` -> `result gt 70`
+            left, right = right, left
+            op = {">": "<", "<": ">", ">=": "<=", "<=": ">="}.get(op, op)
+        if left[0] != "property":
+            raise HTTPException(status_code=400, detail="A $filter comparison needs a property")
+
+        if right[0] == "property":
+            left_kind, right_kind = self._resolve(left[1])[1], self._resolve(right[1])[1]
+            if COMPARABLE_KINDS.get(left_kind) is None or COMPARABLE_KINDS.get(left_kind) != COMPARABLE_KINDS.get(right_kind):
+                raise HTTPException(status_code=400, detail=f"Cannot compare {left[1]} with {right[1]}")
+            left_sql, right_sql = self._column(left[1]), self._column(right[1])
+            if {left_kind, right_kind} == {"time", "timestamp"}:
+                # timestamp columns hold UTC
+                left_sql, right_sql = (f"({sql} AT TIME ZONE 'UTC')" if kind == "timestamp" else sql
+                                       for sql, kind in ((left_sql, left_kind), (right_sql, right_kind)))
+            return f"{left_sql} {op} {right_sql}"
+        value = right[1]
+        if value is None:
+            if op not in ("=", "<>"):
+                raise HTTPException(status_code=400, detail="null can only be compared with eq/ne")
+            return f"{self._typed(left[1], value)} IS {'NOT ' if op == '<>' else ''}NULL"
+        column, kind, json_path = self._resolve(left[1])
+        if kind == "range":
+            return self._range_comparison(column, op, value)
+        if json_path and isinstance(value, (bool, int, float)):
+            # Compare as jsonb with a type guard: a CAST would raise on rows whose
+            # value is of another type (e.g. a Spark boolean next to a Heat number).
+            expr = f"CAST({self.alias}.{column} AS jsonb)" + "".join(f"->'{_quote_key(k)}'" for k in json_path)
+            json_type = "boolean" if isinstance(value, bool) else "number"
+            literal = self.compiler.bind(json.dumps(value))
+            return f"(jsonb_typeof({expr}) = '{json_type}' AND {expr} {op} CAST({literal} AS jsonb))"
+        return f"{self._typed(left[1], value)} {op} {self._bind(left[1], value)}"
+
+    def _range_comparison(self, column, op, value):
+        if isinstance(value, str):
+            value = _parse_datetime(value)
+        if not isinstance(value, datetime):
+            raise HTTPException(status_code=400, detail=f"{column} is a time interval and can only be compared with a datetime")
+        expr = f"{self.alias}.{column}"
+        instant = f"CAST({self.compiler.bind(value)} AS timestamptz)"
+        if op in ("=", "<>"):
+            contains = f"{expr} @> {instant}"
+            return contains if op == "=" else f"NOT ({contains})"
+        return f"{expr} {RANGE_COMPARISONS[op]} tstzrange({instant}, {instant}, '[]')"
+
+    def _string_function(self):
+        _, name = self._next()
+        self._expect("(")
+        prop = self._operand()
+        self._expect(",")
+        needle = self._operand()
+        self._expect(")")
+        if prop[0] != "property" or needle[0] != "literal" or not isinstance(needle[1], str):
+            raise HTTPException(status_code=400, detail=f"{name}() expects (property, 'text')")
+        escaped = needle[1].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pattern = {
+            "contains": f"%{escaped}%", "startswith": f"{escaped}%", "endswith": f"%{escaped}",
+        }[name.lower()]
+        return f"{self._typed(prop[1], pattern, like=True)} LIKE {self.compiler.bind(pattern)}"
+
+    # -- property resolution --------------------------------------------------
+
+    def _resolve(self, path):
+        path = PROPERTY_ALIASES.get((self.entity_name, path), path)
+        column, *json_path = path.split("/")
+        kind = ENTITIES[self.entity_name].columns.get(column)
+        if kind is None:
+            raise HTTPException(status_code=400, detail=f"Unknown property in $filter: {path}")
+        if json_path and kind != "json":
+            raise HTTPException(status_code=400, detail=f"{column} is not a JSON property")
+        return column, kind, json_path
+
+    def _column(self, path):
+        column, kind, json_path = self._resolve(path)
+        if json_path:
+            raise HTTPException(status_code=400, detail="JSON paths can only be compared with literals")
+        if kind == "range":
+            raise HTTPException(status_code=400, detail=f"{column} is a time interval and can only be compared with a datetime")
+        return f"{self.alias}.{column}"
+
+    def _typed(self, path, value, like=False):
+        """Column expression, cast to match the literal it is compared with."""
+        column, kind, json_path = self._resolve(path)
+        expr = f"{self.alias}.{column}"
+        if json_path:
+            expr += "".join(f"->'{_quote_key(k)}'" for k in json_path[:-1])
+            return f"({expr}->>'{_quote_key(json_path[-1])}')"
+        if isinstance(value, str) and (kind in ("json", "geometry", "range") or (kind != "text" and like)):
+            return f"CAST({expr} AS text)"
+        return expr
+
+    def _bind(self, path, value):
+        """Bind `value` as the type of the property it is compared with (400 when it does not fit)."""
+        column, kind, json_path = self._resolve(path)
+        if json_path:
+            if not isinstance(value, str):
+                raise HTTPException(status_code=400, detail=f"{path} can be compared with strings, numbers or booleans")
+        elif kind in ("time", "timestamp"):
+            if isinstance(value, str):
+                value = _parse_datetime(value)
+            if not isinstance(value, datetime):
+                raise HTTPException(status_code=400, detail=f"{column} can only be compared with a datetime")
+            if kind == "timestamp":
+                value = _naive_utc(value)
+        elif kind == "uuid":
+            if not isinstance(value, str):
+                raise HTTPException(status_code=400, detail=f"{column} can only be compared with a UUID string")
+            try:
+                value = uuid.UUID(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid UUID in $filter: {value}")
+        elif not isinstance(value, str):
+            raise HTTPException(status_code=400, detail=f"{column} can only be compared with a string")
+        return self.compiler.bind(value)
+
+
+def _quote_key(key):
+    if not re.fullmatch(r"[A-Za-z0-9_]+", key):
+        raise HTTPException(status_code=400, detail=f"Invalid JSON key: {key}")
+    return key
+
+
+# ---------------------------------------------------------------------------
+# SQL compilation
+# ---------------------------------------------------------------------------
+
+class QueryCompiler:
+    def __init__(self):
+        self.values = {}
+        self._aliases = 0
+
+    def bind(self, value):
+        name = f"p{len(self.values)}"
+        self.values[name] = value
+        return f":{name}"
+
+    def alias(self):
+        name = f"t{self._aliases}"
+        self._aliases += 1
+        return name
+
+    def _orderby(self, entity_name, alias, orderby):
+        entity = ENTITIES[entity_name]
+        clauses = []
+        for item in _split_top_level(orderby, ","):
+            path, _, direction = item.partition(" ")
+            direction = direction.strip().lower() or "asc"
+            if direction not in ("asc", "desc"):
+                raise HTTPException(status_code=400, detail=f"Invalid $orderby direction: {direction}")
+            path = PROPERTY_ALIASES.get((entity_name, path), path)
+            column, *json_path = path.split("/")
+            kind = entity.columns.get(column)
+            if kind is None or kind == "geometry" or (json_path and kind != "json"):
+                raise HTTPException(status_code=400, detail=f"Cannot order by: {path}")
+            # jsonb ordering keeps numbers numeric and tolerates mixed value types.
+            expr = f"{alias}.{column}"
+            if json_path:
+                expr = f"CAST({expr} AS jsonb)" + "".join(f"->'{_quote_key(k)}'" for k in json_path)
+            clauses.append(f"{expr} {direction.upper()}")
+        return ", ".join(clauses)
+
+    def select(self, entity_name, options, alias, conditions=None, nested=False):
+        """
+        Build `SELECT ... FROM <table> <alias> ...` for one entity level.
+        `conditions` is a list of raw SQL predicates (already bound).
+        """
+        entity = ENTITIES[entity_name]
+        columns = options.select or entity.default_select
+        select_list = []
+        for column in columns:
+            if column not in entity.columns:
+                raise HTTPException(status_code=400, detail=f"Unknown property in $select: {column}")
+            if entity.columns[column] == "range":
+                # asyncpg returns ranges as asyncpg.Range, which is not JSON serializable
+                select_list.append(f'CAST({alias}.{column} AS text) AS "{column}"')
+            else:
+                select_list.append(f'{alias}.{column} AS "{column}"')
+
+        for name, nested_options in options.expand.items():
+            link = entity.links.get(name)
+            if link is None:
+                raise HTTPException(status_code=400, detail=f"{entity_name} has no navigation property {name}")
+            child = self.alias()
+            join = [f"{child}.{link.child_key} = {alias}.{link.parent_key}"]
+            if link.many:
+                if nested_options.top is None:
+                    nested_options.top = settings.QUERY_EXPAND_DEFAULT_TOP
+                inner = self.select(link.target, nested_options, child, join, nested=True)
+                sub = f"(SELECT coalesce(json_agg({child}_row), '[]'::json) FROM ({inner}) {child}_row)"
+            else:
+                inner = self.select(link.target, QueryOptions(
+                    select=nested_options.select, expand=nested_options.expand,
+                ), child, join, nested=True)
+                sub = f"(SELECT row_to_json({child}_row) FROM ({inner}) {child}_row)"
+            select_list.append(f'{sub} AS "{name}"')
+
+        if not select_list:
+            raise HTTPException(status_code=400, detail="$select is empty")
+
+        sql = f"SELECT {', '.join(select_list)} FROM {entity.table} {alias}"
+        where = list(conditions or [])
+        if options.filter:
+            where.append(_FilterParser(self, entity_name, alias, options.filter).parse())
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        orderby = options.orderby or entity.default_orderby
+        if orderby:
+            sql += " ORDER BY " + self._orderby(entity_name, alias, orderby)
+        if options.top is not None:
+            sql += f" LIMIT {self.bind(min(options.top, settings.QUERY_MAX_TOP))}"
+        elif not nested:
+            sql += f" LIMIT {self.bind(settings.QUERY_MAX_TOP)}"
+        if options.skip:
+            sql += f" OFFSET {self.bind(options.skip)}"
+        return sql
+
+
+def compile_query(entity_name, options, where=None):
+    """
+    Compile `options` for `entity_name` into (sql, values).
+    `where` maps column -> value for extra equality predicates on the root
+    (path parameters, legacy query parameters).
+    """
+    compiler = QueryCompiler()
+    alias = compiler.alias()
+    conditions = [f"{alias}.{column} = {compiler.bind(value)}" for column, value in (where or {}).items()]
+    sql = compiler.select(entity_name, options, alias, conditions)
+    return sql, compiler.values
+
+
+def decode_row(entity_name, options, row):
+    """Turn a database record into a plain dict, decoding JSON columns."""
+    entity = ENTITIES[entity_name]
+    item = dict(row)
+    for key, value in item.items():
+        json_valued = entity.columns.get(key) == "json" or key in options.expand
+        if json_valued and isinstance(value, str):
+            item[key] = json.loads(value)
+    return item
@@ -1,15 +1,18 @@
 # sensors_router.py
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from db import database
+from query_options import QueryOptions, query_options, compile_query, decode_row
 
 sensors_router = APIRouter(prefix="/Sensors", tags=["Sensors"])
 
 @sensors_router.get("/")
-async def get_sensors():
-    query = "SELECT * FROM sensor"
-    return await database.fetch_all(query=query)
+async def get_sensors(options: QueryOptions = Depends(query_options)):
+    query, values = compile_query("Sensor", options)
+    rows = await database.fetch_all(query=query, values=values)
+    return [decode_row("Sensor", options, row) for row in rows]
 
 @sensors_router.get("/{sensor_id}")
-async def get_sensor(sensor_id: str):
-    query = "SELECT * FROM sensor WHERE id = :sensor_id"
-    return await database.fetch_one(query=query, values={"sensor_id": sensor_id})
+async def get_sensor(sensor_id: str, options: QueryOptions = Depends(query_options)):
+    query, values = compile_query("Sensor", options, where={"id": sensor_id})
+    row = await database.fetch_one(query=query, values=values)
+    return decode_row("Sensor", options, row) if row else None
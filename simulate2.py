@@ -3,6 +3,7 @@ import json
 import random
 import paho.mqtt.client as mqtt
 from config import settings
+from binary_payload import BINARY_TOPIC, KINDS, encode, register_handles
 
 # MQTT Configuration
 MQTT_BROKER = settings.MQTT_BROKER
@@ -52,46 +53,54 @@ ZONE_SENSORS = {
 client = mqtt.Client()
 client.connect(MQTT_BROKER, MQTT_PORT, 60)
 
+SENSOR_TYPES = {"heat": "Heat", "pression": "Pression", "spark": "Spark", "smoke": "Smoke"}
+UNITS = {"heat": "°C", "pression": "bar", "smoke": "ppm"}
+
+# Binary mode: register every datastream once, then send one batch per cycle
+HANDLES = (
+    register_handles(settings.API_URL, [ds for sensors in ZONE_SENSORS.values() for ds in sensors.values()])
+    if settings.PAYLOAD_FORMAT == "binary" else {}
+)
+
 # Helper function to send data
 def send_mqtt_message(topic, payload):
     client.publish(topic, json.dumps(payload))
     print(f"Published to {topic}: {json.dumps(payload)}")
 
 # Function to simulate sensor data
+def send_binary_batch(readings):
+    payload = encode(readings)
+    client.publish(BINARY_TOPIC, payload)
+    print(f"Published {len(readings)} readings to {BINARY_TOPIC} ({len(payload)} bytes)")
+
 def simulate_sensor_data():
     while True:
+        batch = []
         for zone, sensors in ZONE_SENSORS.items():
             # Generate random values for each sensor
-            heat_value = round(random.uniform(50, 90), 1)  # °C
-            pression_value = round(random.uniform(0, 2), 1)  # bar
             spark_value = random.choice([True, False])  # Binary
-            smoke_value = round(random.uniform(0, 10) if spark_value else random.uniform(0, 2), 1)  # ppm
-
-            # Send MQTT messages for each sensor
-            send_mqtt_message("iot_safeindustech/sensors/heat", {
-                "datastream_id": sensors["heat"],
-                "sensor_type": "Heat",
-                "result": {"value": heat_value, "unit": "°C"}
-            })
-
-            send_mqtt_message("iot_safeindustech/sensors/pression", {
-                "datastream_id": sensors["pression"],
-                "sensor_type": "Pression",
-                "result": {"value": pression_value, "unit": "bar"}
-            })
-
-            send_mqtt_message("iot_safeindustech/sensors/spark", {
-                "datastream_id": sensors["spark"],
-                "sensor_type": "Spark",
-                "result": {"value": spark_value}
-            })
+            values = {
+                "heat": round(random.uniform(50, 90), 1),  # °C
+                "pression": round(random.uniform(0, 2), 1),  # bar
+                "spark": spark_value,
+                "smoke": round(random.uniform(0, 10) if spark_value else random.uniform(0, 2), 1),  # ppm
+            }
 
-            send_mqtt_message("iot_safeindustech/sensors/smoke", {
-                "datastream_id": sensors["smoke"],
-                "sensor_type": "Smoke",
-                "result": {"value": smoke_value, "unit": "ppm"}
-            })
+            for sensor, value in values.items():
+                # Datastreams without a handle (JSON mode, unknown id, API down) go out as JSON
+                handle = HANDLES.get(sensors[sensor])
+                if handle is not None:
+                    batch.append((handle, KINDS[SENSOR_TYPES[sensor]], value, time.time()))
+                    continue
+                result = {"value": value, "unit": UNITS[sensor]} if sensor in UNITS else {"value": value}
+                send_mqtt_message(f"iot_safeindustech/sensors/{sensor}", {
+                    "datastream_id": sensors[sensor],
+                    "sensor_type": SENSOR_TYPES[sensor],
+                    "result": result
+                })
 
+        if batch:
+            send_binary_batch(batch)
         time.sleep(5)  # Wait 5 seconds before next set of readings
 
 # Start simulation
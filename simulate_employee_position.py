@@ -4,6 +4,7 @@ import json
 import random
 import paho.mqtt.client as mqtt
 from config import settings
+from binary_payload import BINARY_TOPIC, KIND_POSITION, encode, register_handles
 
 MQTT_BROKER = settings.MQTT_BROKER
 MQTT_PORT = settings.MQTT_PORT
@@ -18,7 +19,14 @@ EMPLOYEE_POSITION_DATASTREAMS = {
 client = mqtt.Client()
 client.connect(MQTT_BROKER, MQTT_PORT, 60)
 
-def simulate_employee_position(employee_name):
+# Binary mode: register the position datastreams once, then send all employees in one message
+HANDLES = (
+    register_handles(settings.API_URL, EMPLOYEE_POSITION_DATASTREAMS.values())
+    if settings.PAYLOAD_FORMAT == "binary" else {}
+)
+
+def simulate_position(employee_name):
+    """(datastream id, {"lat", "lng"}) for one employee, or None."""
     ds_id = EMPLOYEE_POSITION_DATASTREAMS.get(employee_name)
     if not ds_id:
         return None
@@ -37,6 +45,13 @@ def simulate_employee_position(employee_name):
         "lat": base["lat"] + offset(),
         "lng": base["lng"] + offset()
     }
+    return ds_id, simulated_position
+
+def simulate_employee_position(employee_name):
+    simulated = simulate_position(employee_name)
+    if not simulated:
+        return None
+    ds_id, simulated_position = simulated
     data = {
         "datastream_id": ds_id,
         "result": simulated_position
@@ -45,12 +60,25 @@ def simulate_employee_position(employee_name):
 
 def publish_employee_positions():
     while True:
+        batch = []
         for employee in EMPLOYEE_POSITION_DATASTREAMS.keys():
+            # Datastreams without a handle (JSON mode, unknown id, API down) go out as JSON
+            if EMPLOYEE_POSITION_DATASTREAMS[employee] in HANDLES:
+                simulated = simulate_position(employee)
+                if simulated:
+                    ds_id, position = simulated
+                    batch.append((HANDLES[ds_id], KIND_POSITION, (position["lat"], position["lng"]), time.time()))
+                continue
             payload = simulate_employee_position(employee)
-            if payload:
-                topic = "iot_safeindustech/sensors/position"
-                client.publish(topic, payload)
-                print(f"Published position for {employee}: {payload}")
+            if not payload:
+                continue
+            topic = "iot_safeindustech/sensors/position"
+            client.publish(topic, payload)
+            print(f"Published position for {employee}: {payload}")
+        if batch:
+            binary_payload = encode(batch)
+            client.publish(BINARY_TOPIC, binary_payload)
+            print(f"Published {len(batch)} positions to {BINARY_TOPIC} ({len(binary_payload)} bytes)")
         time.sleep(10)
 
 if __name__ == "__main__":
@@ -1,13 +1,24 @@
+import os
+import sys
 import time
 import json
 import random
 import requests
 import paho.mqtt.client as mqtt
 
+# binary_payload.py lives in the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from binary_payload import BINARY_TOPIC, KINDS, encode, register_handles
+
 # MQTT configuration
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 
+# "binary": one batched message per cycle using datastream handles, "json": one message per reading
+PAYLOAD_FORMAT = "binary"
+API_URL = "http://localhost:8000"
+SENSOR_TYPES = {"heat": "Heat", "pression": "Pression", "spark": "Spark", "smoke": "Smoke"}
+
 client = mqtt.Client()
 client.connect(MQTT_BROKER, MQTT_PORT, 60)
 
@@ -51,6 +62,11 @@ ZONE_SENSORS =  {
     }
 }
 
+HANDLES = (
+    register_handles(API_URL, [ds for sensors in ZONE_SENSORS.values() for ds in sensors.values()])
+    if PAYLOAD_FORMAT == "binary" else {}
+)
+
 def fetch_settings():
     try:
         response = requests.get("http://localhost:8001/simulation-settings")
@@ -67,12 +83,21 @@ def simulate_value(sensor, params):
 def simulate_sensor_data():
     while True:
         settings = fetch_settings()
+        batch = []
         for zone, sensors in settings.items():
             for sensor, value in sensors.items():
                 simulated_val = simulate_value(sensor, sensors)
+                # Datastreams without a handle (JSON mode, unknown id, API down) go out as JSON
+                handle = HANDLES.get(ZONE_SENSORS[zone][sensor])
+                if handle is not None:
+                    batch.append((handle, KINDS[SENSOR_TYPES[sensor]], simulated_val, time.time()))
+                    continue
                 payload = {"datastream_id": ZONE_SENSORS[zone][sensor], "result": {"value": simulated_val}}
                 client.publish(f"iot_safeindustech/sensors/{sensor}", json.dumps(payload))
                 print(f"Published to {sensor} for {zone}: {simulated_val}")
+        if batch:
+            client.publish(BINARY_TOPIC, encode(batch))
+            print(f"Published {len(batch)} readings to {BINARY_TOPIC}")
         time.sleep(5)
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+# stats_router.py
+from fastapi import APIRouter, HTTPException
+from window_stats import window_stats, WINDOWS
+from anomaly_detector import anomaly_detector
+
+stats_router = APIRouter(prefix="/Stats", tags=["Stats"])
+
+# All endpoints read the in-memory windows fed by the MQTT ingest; none of them query the database.
+
+@stats_router.get("/")
+async def get_stats_overview():
+    return {
+        "windows": list(WINDOWS),
+        "datastreams": len(window_stats.datastreams),
+        "zones": sorted(window_stats.zones),
+    }
+
+@stats_router.get("/datastreams/{datastream_id}")
+async def get_datastream_stats(datastream_id: str):
+    stats = window_stats.datastream_stats(datastream_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No readings received for this datastream yet")
+    return {"datastream_id": datastream_id, "stats": stats}
+
+@stats_router.get("/zones")
+async def get_all_zone_stats():
+    return window_stats.all_zone_stats()
+
+@stats_router.get("/zones/{zone_name}")
+async def get_zone_stats(zone_name: str):
+    stats = window_stats.zone_stats(zone_name)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No readings received for this zone yet")
+    return {"zone": zone_name, "stats": stats}
+
+@stats_router.get("/anomalies")
+async def get_active_anomalies():
+    return anomaly_detector.active_anomalies()
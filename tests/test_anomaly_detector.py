@@ -0,0 +1,66 @@
+# tests/test_anomaly_detector.py
+import asyncio
+import random
+import time
+
+import anomaly_detector
+from anomaly_detector import AnomalyDetector
+
+# Stationary random series as sent by simulate2.py (one reading every 5 s)
+NOISE_SERIES = {
+    "Heat": lambda: random.uniform(50, 90),
+    "Pression": lambda: random.uniform(0, 2),
+    "Smoke": lambda: random.uniform(0, 10) if random.random() < 0.5 else random.uniform(0, 2),
+}
+
+
+def _feed(detector, readings, start, interval):
+    """Feed [(datastream, value)] per step, one tick per step; returns the ticks' results."""
+    results = []
+    for step, batch in enumerate(readings):
+        for name, value in batch:
+            detector.observe(name, value, name, name, start + step * interval)
+        changed = detector.tick()
+        for zone, anomaly in changed.items():
+            detector.mark_written(zone, anomaly)
+        results.append(changed)
+    return results
+
+
+def test_stationary_noise_raises_no_alarm():
+    # Noise is not an anomaly: an hour of simulator readings must not raise or clear anything.
+    random.seed(0)
+    steps = [[(sensor_type, draw()) for sensor_type, draw in NOISE_SERIES.items()] for _ in range(720)]
+    results = _feed(AnomalyDetector(), steps, time.time(), 5.0)
+    assert sum(len(changed) for changed in results) == 0
+
+
+def test_rapid_rise_is_detected():
+    random.seed(1)
+    warmup = [[("Heat", 30 + random.gauss(0, 0.3))] for _ in range(60)]
+    ramp = [[("Heat", 30 + 10 * (i + 1) * 5 / 60)] for i in range(12)]    # 10 °C/min, still under 70 °C
+    results = _feed(AnomalyDetector(), warmup + ramp, time.time(), 5.0)
+    raised = [i for i, changed in enumerate(results) if changed.get("Heat")]
+    assert raised and raised[0] - len(warmup) < 8    # within 40 s
+
+
+def test_failed_write_is_retried(monkeypatch):
+    detector = AnomalyDetector()
+    monkeypatch.setattr(anomaly_detector, "anomaly_detector", detector)
+    detector.zone_alerts = {"Production": ("ANOMALY_READING", "Heat")}
+    writes = []
+
+    async def failing(zone_name, code, sensor_type):
+        raise ConnectionError("database unavailable")
+
+    async def succeeding(zone_name, code, sensor_type):
+        writes.append((zone_name, code, sensor_type))
+
+    monkeypatch.setattr(anomaly_detector, "set_anomaly_alert", failing)
+    asyncio.run(anomaly_detector.apply_zone_alerts(detector.tick()))
+    assert detector.tick() == {"Production": ("ANOMALY_READING", "Heat")}
+
+    monkeypatch.setattr(anomaly_detector, "set_anomaly_alert", succeeding)
+    asyncio.run(anomaly_detector.apply_zone_alerts(detector.tick()))
+    assert writes == [("Production", "ANOMALY_READING", "Heat")]
+    assert detector.tick() == {}
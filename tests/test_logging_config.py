@@ -0,0 +1,24 @@
+# tests/test_logging_config.py
+import logging
+
+from logging_config import RateLimitFilter
+
+
+def _record(level, created):
+    record = logging.LogRecord("ingest", level, __file__, 1, "Reading rejected: %s", ("x",), None)
+    record.created = created
+    return record
+
+
+def test_info_is_rate_limited_per_template():
+    limit = RateLimitFilter(per_second=3)
+    passed = [limit.filter(_record(logging.INFO, 100.5)) for _ in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    next_second = _record(logging.INFO, 101.0)
+    assert limit.filter(next_second) and next_second.suppressed == 7
+
+
+def test_warnings_and_errors_are_never_suppressed():
+    limit = RateLimitFilter(per_second=3)
+    for level in (logging.WARNING, logging.ERROR):
+        assert all(limit.filter(_record(level, 100.5)) for _ in range(50))
@@ -0,0 +1,70 @@
+# topic_dispatch.py
+"""
+MQTT topic -> handler registry.
+
+Handlers are registered under MQTT topic filters (`+` matches one level, `#`
+the rest). The topic alone picks the handler, before the payload is looked
+at, and the result of matching is cached per topic string, so dispatching a
+message is one dict lookup. Messages on topics without a handler are counted
+and dropped without being decoded.
+
+A handler is any object with `async handle(topic, payload)`; mqtt_client.py
+defines one per sensor family.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Topics seen are cached; past this many distinct topics the cache is reset
+# so random topics cannot grow it without bound.
+MAX_CACHED_TOPICS = 10000
+
+
+def _matches(pattern_levels, topic_levels):
+    for i, level in enumerate(pattern_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+class TopicRegistry:
+    def __init__(self):
+        self.routes = []        # (pattern, pattern levels, handler), in registration order
+        self.resolved = {}      # topic -> handler or None
+        self.handled = {}       # pattern -> messages dispatched
+        self.rejected = 0
+
+    def register(self, pattern, handler):
+        self.routes.append((pattern, pattern.split("/"), handler))
+        self.handled[pattern] = 0
+        self.resolved.clear()
+
+    def patterns(self):
+        return [pattern for pattern, _, _ in self.routes]
+
+    def lookup(self, topic):
+        """(pattern, handler) of the first matching route, or None."""
+        if topic in self.resolved:
+            return self.resolved[topic]
+        levels = topic.split("/")
+        route = next(((pattern, handler) for pattern, pattern_levels, handler in self.routes
+                      if _matches(pattern_levels, levels)), None)
+        if len(self.resolved) >= MAX_CACHED_TOPICS:
+            self.resolved.clear()
+        self.resolved[topic] = route
+        return route
+
+    async def dispatch(self, topic, payload):
+        route = self.lookup(topic)
+        if route is None:
+            self.rejected += 1
+            logger.debug("No handler for topic %s", topic)
+            return
+        pattern, handler = route
+        self.handled[pattern] += 1
+        await handler.handle(topic, payload)
+
+    def metrics(self):
+        return {"handled": dict(self.handled), "rejected": self.rejected}
@@ -0,0 +1,126 @@
+# warmup.py
+"""
+Startup warm-up and readiness.
+
+Before the MQTT listener starts, `warm_up()`:
+  1. checks out DB_POOL_MIN_SIZE connections at once, so the pool is fully
+     opened instead of growing on the first requests;
+  2. runs every hot statement once on each of those connections, which fills
+     asyncpg's per-connection prepared statement cache (writes run inside a
+     rolled-back transaction);
+  3. loads the metadata cache (datastreams, zones, sensors, latest values),
+     the employee -> position datastream mapping and the binary payload
+     datastream handles.
+
+A failed warm-up is retried with exponential backoff (`warm_up_with_retry()`),
+and the listener is only started after it has succeeded, so ingest never
+runs with empty position and handle maps. `/ready` only reports ready once
+this is done and the MQTT subscription is live; the listener reconnects with
+backoff when the broker goes away, so a node is unready only while it is
+actually disconnected.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+
+from config import settings
+from db import database
+from metadata_cache import metadata_cache
+from position_tracker import position_tracker
+from datastream_handles import handle_registry
+import mqtt_client
+import zone_state
+
+logger = logging.getLogger(__name__)
+
+warmup_state = {"started_at": None, "completed_at": None, "duration_ms": None, "error": None, "attempts": 0}
+
+
+def _hot_statements(datastream_id, zone_id):
+    """(query, values, is_write) for the statements the API and ingest run all the time."""
+    statements = [
+        ("SELECT 1", {}, False),
+        (mqtt_client.ZONE_LOOKUP_QUERY, {"ds_id": uuid.UUID(datastream_id)}, False),
+        (mqtt_client.INSERT_OBSERVATIONS_QUERY, {
+            "obs_ids": [uuid.uuid4()], "ds_ids": [uuid.UUID(datastream_id)],
+            "phenomenon_times": [datetime.now(timezone.utc)], "results": ['{"value": 0}'],
+        }, True),
+    ]
+    if zone_id:
+        for sensor_type, query in zone_state.UPSERT_QUERIES.items():
+            statements.append((query, {
+                "zone_id": zone_id, "value": False if sensor_type == "Spark" else 0.0,
+                "alert_code": None,
+            }, True))
+        statements.append((zone_state.ACTIVE_ALERTS_QUERY, {}, False))
+    return statements
+
+
+async def _prime_connection(statements, checked_out, all_checked_out):
+    async with database.connection() as connection:
+        # Hold this connection until every worker has its own, so each one
+        # primes a different pool connection.
+        checked_out.append(connection)
+        if len(checked_out) >= settings.DB_POOL_MIN_SIZE:
+            all_checked_out.set()
+        await all_checked_out.wait()
+        for query, values, is_write in statements:
+            if is_write:
+                async with connection.transaction(force_rollback=True):
+                    await connection.execute(query=query, values=values)
+            else:
+                await connection.fetch_all(query=query, values=values)
+
+
+async def warm_up():
+    """One warm-up attempt; True when it succeeded."""
+    warmup_state.update(started_at=time.time(), completed_at=None, duration_ms=None, error=None)
+    warmup_state["attempts"] += 1
+    try:
+        await metadata_cache.load()
+        await position_tracker.load()
+        await handle_registry.load()
+
+        statements = [("SELECT 1", {}, False)]
+        for datastream_id, datastream in metadata_cache.datastreams.items():
+            if datastream["zone_id"]:
+                statements = _hot_statements(datastream_id, datastream["zone_id"])
+                break
+
+        checked_out, all_checked_out = [], asyncio.Event()
+        await asyncio.wait_for(
+            asyncio.gather(*[
+                _prime_connection(statements, checked_out, all_checked_out)
+                for _ in range(settings.DB_POOL_MIN_SIZE)
+            ]),
+            timeout=settings.WARMUP_TIMEOUT_SECONDS,
+        )
+        warmup_state["completed_at"] = time.time()
+        warmup_state["duration_ms"] = round((warmup_state["completed_at"] - warmup_state["started_at"]) * 1000, 1)
+        logger.info("Warm-up complete in %s ms (%d datastreams, %d connections)",
+                    warmup_state["duration_ms"], len(metadata_cache.datastreams), settings.DB_POOL_MIN_SIZE)
+        return True
+    except Exception as e:
+        warmup_state["error"] = str(e)
+        logger.error("Warm-up failed: %s", e)
+        return False
+
+
+async def warm_up_with_retry():
+    """Run warm_up() until it succeeds, doubling the pause between attempts up to WARMUP_RETRY_MAX_SECONDS."""
+    delay = settings.WARMUP_RETRY_INITIAL_SECONDS
+    while not await warm_up():
+        logger.warning("Retrying warm-up in %s s (attempt %d failed)", delay, warmup_state["attempts"])
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, settings.WARMUP_RETRY_MAX_SECONDS)
+
+
+def readiness():
+    checks = {
+        "warmup_complete": warmup_state["completed_at"] is not None,
+        "mqtt_subscribed": mqtt_client.mqtt_state["subscribed"],
+        "database_connected": database.is_connected,
+    }
+    return all(checks.values()), {**checks, "warmup": warmup_state, "mqtt": mqtt_client.mqtt_state}
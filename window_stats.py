@@ -0,0 +1,171 @@
+# window_stats.py
+"""
+In-memory rolling statistics (min/max/avg/p95) per datastream and per zone.
+
+The MQTT ingest path records every numeric reading here. Each series keeps
+its samples in a numpy ring buffer of STATS_BUFFER_SIZE samples, and a window
+is computed with vectorized numpy calls over it. A buffer that fills up while
+its oldest sample is still inside the longest window doubles, up to
+STATS_BUFFER_MAX_SIZE, so fast series keep a full 60m window instead of
+silently reporting the last few minutes. Past that cap the oldest samples are
+overwritten and every window they belonged to is reported with
+"truncated": true. Samples may arrive out of time order (device timestamps of
+binary batches, several sources feeding one zone series); a buffer that got
+a late sample is sorted once before its windows are next computed. Computed
+windows are cached per series and recomputed at
+most once per STATS_REFRESH_SECONDS, so dashboard polling is a dictionary
+lookup and never touches the database.
+"""
+import time
+
+import numpy as np
+
+from config import settings
+
+# Window label -> length in seconds
+WINDOWS = {"1m": 60, "5m": 300, "60m": 3600}
+
+
+class RingBuffer:
+    """
+    Buffer of (timestamp, value) samples. When full, it grows (up to
+    `max_capacity`) instead of overwriting a sample younger than `keep_seconds`.
+    """
+
+    def __init__(self, capacity, max_capacity=None, keep_seconds=0.0):
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.capacity = capacity
+        self.max_capacity = max(capacity, max_capacity or capacity)
+        self.keep_seconds = keep_seconds
+        self.size = 0
+        self.head = 0  # next slot to write
+        self.evicted_until = -np.inf  # timestamp of the newest overwritten sample
+        self.newest = -np.inf
+        self.in_order = True          # False once a sample older than `newest` was appended
+
+    def append(self, timestamp, value):
+        if self.size == self.capacity:
+            oldest = self.times[self.head]
+            if self.newest - min(timestamp, oldest) < self.keep_seconds and self.capacity < self.max_capacity:
+                self._grow(min(self.capacity * 2, self.max_capacity))
+            elif self.in_order and timestamp < oldest:
+                # Older than everything kept: it would be the next sample evicted anyway.
+                self.evicted_until = max(self.evicted_until, timestamp)
+                return
+            else:
+                self.evicted_until = max(self.evicted_until, oldest)
+        if timestamp < self.newest:
+            self.in_order = False
+        else:
+            self.newest = timestamp
+        self.times[self.head] = timestamp
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def _grow(self, capacity):
+        times, values = self.ordered()
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.times[:self.size] = times
+        self.values[:self.size] = values
+        self.head = self.size
+        self.capacity = capacity
+
+    def ordered(self):
+        """Samples oldest-first by timestamp (views when the buffer has not wrapped and is in order)."""
+        if self.size < self.capacity:
+            times, values = self.times[:self.size], self.values[:self.size]
+        else:
+            times, values = np.roll(self.times, -self.head), np.roll(self.values, -self.head)
+        if self.in_order:
+            return times, values
+        # Store the sorted samples back, so the next overwrite evicts the oldest one.
+        order = np.argsort(times, kind="stable")
+        self.times[:self.size], self.values[:self.size] = times[order], values[order]
+        self.head = self.size % self.capacity
+        self.in_order = True
+        return self.times[:self.size], self.values[:self.size]
+
+
+class Series:
+    def __init__(self, capacity, max_capacity=None):
+        self.buffer = RingBuffer(capacity, max_capacity, keep_seconds=max(WINDOWS.values()))
+        self.cached_at = 0.0
+        self.cached = None
+
+    def add(self, timestamp, value):
+        self.buffer.append(timestamp, value)
+
+    def snapshot(self, now):
+        # Recompute even without new samples: windows slide with the clock.
+        if self.cached is None or now - self.cached_at >= settings.STATS_REFRESH_SECONDS:
+            self.cached = self._compute(now)
+            self.cached_at = now
+        return self.cached
+
+    def _compute(self, now):
+        times, values = self.buffer.ordered()
+        stats = {}
+        for label, seconds in WINDOWS.items():
+            # Samples are sorted by timestamp, so the window is a suffix.
+            start = np.searchsorted(times, now - seconds, side="left")
+            window = values[start:]
+            # Samples of this window were overwritten: the stats cover only its most recent part.
+            truncated = bool(self.buffer.evicted_until >= now - seconds)
+            if window.size == 0:
+                stats[label] = {"count": 0, "min": None, "max": None, "avg": None, "p95": None, "truncated": truncated}
+                continue
+            stats[label] = {
+                "count": int(window.size),
+                "min": float(window.min()),
+                "max": float(window.max()),
+                "avg": float(window.mean()),
+                "p95": float(np.percentile(window, 95)),
+                "truncated": truncated,
+            }
+        stats["last_value"] = float(values[-1]) if values.size else None
+        stats["last_updated"] = float(times[-1]) if times.size else None
+        return stats
+
+
+class WindowStats:
+    def __init__(self, capacity=None, max_capacity=None):
+        self.capacity = capacity or settings.STATS_BUFFER_SIZE
+        self.max_capacity = max_capacity or settings.STATS_BUFFER_MAX_SIZE
+        self.datastreams = {}   # datastream_id -> Series
+        self.zones = {}         # zone name -> {sensor_type -> Series}
+
+    def _series(self, table, key):
+        series = table.get(key)
+        if series is None:
+            series = table[key] = Series(self.capacity, self.max_capacity)
+        return series
+
+    def record(self, datastream_id, value, zone_name=None, sensor_type=None, timestamp=None):
+        """Add one reading. Booleans (Spark) are stored as 0/1."""
+        timestamp = timestamp or time.time()
+        value = float(value)
+        self._series(self.datastreams, str(datastream_id)).add(timestamp, value)
+        if zone_name and sensor_type:
+            zone = self.zones.setdefault(zone_name, {})
+            self._series(zone, sensor_type).add(timestamp, value)
+
+    def datastream_stats(self, datastream_id):
+        series = self.datastreams.get(str(datastream_id))
+        return series.snapshot(time.time()) if series else None
+
+    def zone_stats(self, zone_name):
+        zone = self.zones.get(zone_name)
+        if zone is None:
+            return None
+        now = time.time()
+        return {sensor_type: series.snapshot(now) for sensor_type, series in zone.items()}
+
+    def all_zone_stats(self):
+        return {zone_name: self.zone_stats(zone_name) for zone_name in self.zones}
+
+
+window_stats = WindowStats()
@@ -0,0 +1,260 @@
+# zone_state.py
+"""
+Typed per-zone state: latest reading per sensor type and the active alert.
+
+Replaces the readings/alert that used to live in the untyped zone.properties
+jsonb blob. Every reading is a single UPSERT of one numeric column plus the
+alert columns, so there is no read-modify-write of a JSON document and no
+json.loads on the read side. Active alerts are covered by a partial index, so
+alarm queries only touch zones that are actually in alarm, however many zones
+and sensor types exist.
+
+Each sensor type has its own alert slot (heat_alert, spark_alert, ...) and
+the anomaly stage has one more, so a reading only ever raises or clears the
+alert of its own type: a normal heat reading cannot clear a spark alarm. The
+zone alert (alert_code/message/severity/since) is derived from the slots by a
+trigger on every write and is the highest-severity active one.
+"""
+from db import database
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS zone_state (
+        zone_id          uuid PRIMARY KEY REFERENCES zone(id) ON DELETE CASCADE,
+        current_heat     double precision,
+        current_pression double precision,
+        current_smoke    double precision,
+        current_spark    boolean,
+        heat_alert       text,
+        pression_alert   text,
+        smoke_alert      text,
+        spark_alert      text,
+        anomaly_alert    text,
+        anomaly_sensor_type text,
+        alert_code       text,
+        alert_message    text,
+        alert_severity   smallint,
+        alert_since      timestamptz,
+        updated_at       timestamptz NOT NULL DEFAULT now()
+    )
+    """,
+    # Tables created before the alert slots existed
+    """
+    ALTER TABLE zone_state
+        ADD COLUMN IF NOT EXISTS heat_alert text,
+        ADD COLUMN IF NOT EXISTS pression_alert text,
+        ADD COLUMN IF NOT EXISTS smoke_alert text,
+        ADD COLUMN IF NOT EXISTS spark_alert text,
+        ADD COLUMN IF NOT EXISTS anomaly_alert text,
+        ADD COLUMN IF NOT EXISTS anomaly_sensor_type text
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS zone_state_active_alert_idx
+        ON zone_state (alert_severity DESC, zone_id)
+        WHERE alert_code IS NOT NULL
+    """,
+]
+
+# Sensor type -> typed column
+SENSOR_COLUMNS = {
+    "Heat": "current_heat",
+    "Pression": "current_pression",
+    "Smoke": "current_smoke",
+    "Spark": "current_spark",
+}
+
+# Sensor type -> its alert slot
+ALERT_COLUMNS = {
+    "Heat": "heat_alert",
+    "Pression": "pression_alert",
+    "Smoke": "smoke_alert",
+    "Spark": "spark_alert",
+}
+# Threshold slots in tie-break order (equal severities: the first one wins)
+ALERT_SLOTS = [ALERT_COLUMNS[sensor_type] for sensor_type in ("Spark", "Smoke", "Heat", "Pression")]
+
+# Alert code -> (message, severity). Severity: 1 = warning, 2 = alarm, 3 = critical.
+ALERTS = {
+    "HIGH_TEMPERATURE": ("High Temperature Detected!", 2),
+    "HIGH_PRESSURE": ("Pressure Exceeds Safe Levels!", 2),
+    "SPARK_DETECTED": ("Spark Detected! Fire Risk!", 3),
+    "HIGH_SMOKE": ("High Smoke Concentration!", 3),
+    "ANOMALY_RAPID_RISE": ("Rapid {sensor_type} Rise Detected!", 1),
+    "ANOMALY_READING": ("Abnormal {sensor_type} Reading Detected!", 1),
+}
+
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _derive_alert_function():
+    """
+    Trigger function setting the zone alert to the highest-severity active
+    slot. Generated from ALERTS, so it is replaced on every startup and stays
+    in step with the codes above. alert_since keeps its value while the same
+    alert stays the zone alert.
+    """
+    severities = " ".join(f"WHEN {_literal(code)} THEN {severity}" for code, (_, severity) in ALERTS.items())
+    messages = " ".join(
+        f"WHEN {_literal(code)} THEN "
+        + (f"replace({_literal(message)}, '{{sensor_type}}', coalesce(NEW.anomaly_sensor_type, ''))"
+           if "{sensor_type}" in message else _literal(message))
+        for code, (message, _) in ALERTS.items()
+    )
+    slots = ", ".join(f"(NEW.{column})" for column in [*ALERT_SLOTS, "anomaly_alert"])
+    return f"""
+        CREATE OR REPLACE FUNCTION zone_state_derive_alert() RETURNS trigger AS $$
+        BEGIN
+            SELECT slot.code INTO NEW.alert_code
+            FROM (VALUES {slots}) AS slot(code)
+            WHERE slot.code IS NOT NULL
+            ORDER BY CASE slot.code {severities} ELSE 0 END DESC
+            LIMIT 1;
+            NEW.alert_severity := CASE NEW.alert_code {severities} END;
+            NEW.alert_message := CASE NEW.alert_code {messages} END;
+            IF NEW.alert_code IS NULL THEN
+                NEW.alert_since := NULL;
+            ELSIF TG_OP = 'INSERT' THEN
+                NEW.alert_since := now();
+            ELSIF OLD.alert_code IS DISTINCT FROM NEW.alert_code THEN
+                NEW.alert_since := now();
+            ELSE
+                NEW.alert_since := OLD.alert_since;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """
+
+SCHEMA += [
+    _derive_alert_function(),
+    # Replaced in place: there is no moment without the trigger for other nodes' writes.
+    """
+    CREATE OR REPLACE TRIGGER zone_state_derive_alert
+        BEFORE INSERT OR UPDATE ON zone_state
+        FOR EACH ROW EXECUTE FUNCTION zone_state_derive_alert()
+    """,
+    # One-time backfill of the readings from the legacy jsonb properties; zones
+    # already present are left alone. Legacy alerts are not carried over: the
+    # next reading of each type raises its alert again.
+    """
+    INSERT INTO zone_state (zone_id, current_heat, current_pression, current_smoke, current_spark)
+    SELECT
+        z.id,
+        CAST(z.properties->>'current_heat' AS double precision),
+        CAST(z.properties->>'current_pression' AS double precision),
+        CAST(z.properties->>'current_smoke' AS double precision),
+        z.properties->>'current_spark' IN ('true', '1', '1.0')
+    FROM zone z
+    ON CONFLICT (zone_id) DO NOTHING
+    """,
+]
+
+
+def _upsert_query(column, alert_column):
+    # Only this sensor type's value and alert slot; the trigger derives the zone alert.
+    return f"""
+        INSERT INTO zone_state (zone_id, {column}, {alert_column}, updated_at)
+        VALUES (:zone_id, :value, :alert_code, now())
+        ON CONFLICT (zone_id) DO UPDATE SET
+            {column} = EXCLUDED.{column},
+            {alert_column} = EXCLUDED.{alert_column},
+            updated_at = now()
+    """
+
+
+UPSERT_QUERIES = {
+    sensor_type: _upsert_query(column, ALERT_COLUMNS[sensor_type])
+    for sensor_type, column in SENSOR_COLUMNS.items()
+}
+
+ACTIVE_ALERTS_QUERY = """
+    SELECT z.id, z.name, z.risk_level,
+           s.current_heat, s.current_pression, s.current_smoke, s.current_spark,
+           s.heat_alert, s.pression_alert, s.smoke_alert, s.spark_alert, s.anomaly_alert,
+           s.alert_code, s.alert_message, s.alert_severity, s.alert_since, s.updated_at
+    FROM zone_state s
+    JOIN zone z ON z.id = s.zone_id
+    WHERE s.alert_code IS NOT NULL
+    ORDER BY z.name
+"""
+
+ALL_ZONES_QUERY = """
+    SELECT z.id, z.name, z.risk_level,
+           s.current_heat, s.current_pression, s.current_smoke, s.current_spark,
+           s.heat_alert, s.pression_alert, s.smoke_alert, s.spark_alert, s.anomaly_alert,
+           s.alert_code, s.alert_message, s.alert_severity, s.alert_since, s.updated_at
+    FROM zone z
+    LEFT JOIN zone_state s ON s.zone_id = z.id
+    ORDER BY z.name
+"""
+
+
+async def ensure_schema():
+    # One transaction, serialized across nodes starting together (a rolling restart),
+    # so concurrent CREATE OR REPLACE statements cannot collide.
+    async with database.transaction():
+        await database.execute(query="SELECT pg_advisory_xact_lock(hashtext('zone_state.ensure_schema'))")
+        for statement in SCHEMA:
+            await database.execute(query=statement)
+
+
+async def record_reading(zone_id, sensor_type, value, alert_code=None):
+    """Store the latest reading of a sensor type and set or clear that type's alert."""
+    await database.execute(query=UPSERT_QUERIES[sensor_type], values={
+        "zone_id": zone_id,
+        "value": value,
+        "alert_code": alert_code,
+    })
+
+
+async def set_anomaly_alert(zone_name, alert_code, sensor_type):
+    """Raise an anomaly alert; it becomes the zone alert only while no threshold alert is active."""
+    query = """
+        UPDATE zone_state s
+        SET anomaly_alert = :alert_code, anomaly_sensor_type = :sensor_type, updated_at = now()
+        FROM zone z
+        WHERE z.id = s.zone_id AND z.name = :zone_name
+    """
+    await database.execute(query=query, values={
+        "zone_name": zone_name, "alert_code": alert_code, "sensor_type": sensor_type,
+    })
+
+
+async def clear_anomaly_alert(zone_name):
+    """Clear the anomaly slot; threshold alerts are left alone."""
+    query = """
+        UPDATE zone_state s
+        SET anomaly_alert = NULL, anomaly_sensor_type = NULL, updated_at = now()
+        FROM zone z
+        WHERE z.id = s.zone_id AND z.name = :zone_name AND s.anomaly_alert IS NOT NULL
+    """
+    await database.execute(query=query, values={"zone_name": zone_name})
+
+
+def properties_of(row):
+    """The properties dict clients used to get from zone.properties."""
+    properties = {
+        "current_heat": row["current_heat"],
+        "current_pression": row["current_pression"],
+        "current_smoke": row["current_smoke"],
+        "current_spark": row["current_spark"],
+    }
+    properties = {key: value for key, value in properties.items() if value is not None}
+    if row["alert_code"]:
+        properties["alert"] = row["alert_message"]
+    return properties
+
+
+def alert_of(row):
+    if not row["alert_code"]:
+        return None
+    return {
+        "code": row["alert_code"],
+        "message": row["alert_message"],
+        "severity": row["alert_severity"],
+        "since": row["alert_since"],
+        # Every active slot, the zone alert included
+        "active": [row[column] for column in [*ALERT_SLOTS, "anomaly_alert"] if row[column]],
+    }